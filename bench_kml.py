@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Benchmark generate_kml.py against synthetic Prospective/Installed sheets.
+
+Builds CSVs of each requested size (75% prospective rows, 25% installed) with every
+column the generator knows about, serves them from a local HTTP server, and times each
+stage (fetch, parse, sort, render, write) in a fresh child process so peak RSS is per size.
+Results go to a JSON file that can be diffed across commits:
+
+    python3 bench_kml.py --sizes 1000,10000,100000 --output bench_output.json
+"""
+import argparse
+import csv
+import functools
+import http.server
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+
+# Synthetic points land inside this box (roughly North Texas).
+BBOX = (-98.5, 32.0, -96.0, 33.8)  # west, south, east, north
+
+PROSPECTIVE_COLUMNS = [
+    "Name", "Latitude", "Longitude", "Category",
+    "Street Address", "Proposed By", "Assigned To", "Node Owner",
+    "Installed Node Name", "FCC ID", "FCC Link", "Notes",
+]
+INSTALLED_COLUMNS = [
+    "Node ID", "Node Name", "Latitude", "Longitude", "Node Class", "Node Status",
+    "Node Owner", "Site Owner", "Site Contact Name", "Site Contact Phone", "Site Contact Email",
+    "Node Baseboard", "Antenna", "Antenna Gain", "Battery Type", "Battery Quantity",
+    "Solar", "Solar Panel Wattage", "Installation Type", "Installed Elevation",
+    "Installed Date", "Last Updated Date", "Decommissioned Date",
+    "FCC ID", "FCC Link", "Notes",
+]
+
+# -----------------------
+# Synthetic sheets
+# -----------------------
+def maybe(rng, value, p=0.6):
+    return value if rng.random() < p else ""
+
+def write_prospective_csv(path: str, rows: int, rng, gk) -> None:
+    categories = list(gk.PROSPECTIVE_CATEGORY_COLORS) + ["Unlisted Category"]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(PROSPECTIVE_COLUMNS)
+        for i in range(rows):
+            w.writerow([
+                f"Prospect {i}",
+                f"{rng.uniform(BBOX[1], BBOX[3]):.6f}",
+                f"{rng.uniform(BBOX[0], BBOX[2]):.6f}",
+                rng.choice(categories),
+                maybe(rng, f"{rng.randint(100, 9999)} Main St"),
+                maybe(rng, f"user{rng.randint(1, 200)}"),
+                maybe(rng, f"user{rng.randint(1, 200)}", 0.3),
+                maybe(rng, f"owner{rng.randint(1, 500)}", 0.3),
+                maybe(rng, f"Node {rng.randint(0, max(1, rows // 4))}", 0.1),
+                maybe(rng, f"2A{rng.randint(1000, 9999)}-X", 0.2),
+                maybe(rng, "https://fccid.io/2AXXX-1?a=1&b=2", 0.2),
+                maybe(rng, "Rooftop <clear> LOS & power", 0.4),
+            ])
+
+def write_installed_csv(path: str, rows: int, rng, gk) -> None:
+    classes = list(gk.NODE_CLASS_ORDER) + ["Unlisted Class"]
+    statuses = list(gk.INSTALLED_STATUS_COLORS) + ["Unlisted Status"]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(INSTALLED_COLUMNS)
+        for i in range(rows):
+            w.writerow([
+                f"{i:08X}",
+                f"Node {i}",
+                f"{rng.uniform(BBOX[1], BBOX[3]):.6f}",
+                f"{rng.uniform(BBOX[0], BBOX[2]):.6f}",
+                rng.choice(classes),
+                rng.choice(statuses),
+                maybe(rng, f"owner{rng.randint(1, 500)}"),
+                maybe(rng, f"site{rng.randint(1, 500)}"),
+                maybe(rng, "Pat Example"),
+                maybe(rng, "555-0100"),
+                maybe(rng, "pat@example.org"),
+                maybe(rng, rng.choice(["RAK4631", "Heltec V3", "T-Beam"])),
+                maybe(rng, rng.choice(["Rokland 5.8", "Stock whip", "Alfa 8dBi"])),
+                maybe(rng, rng.choice(["3", "5.8", "8 dBi"])),
+                maybe(rng, "18650"),
+                maybe(rng, str(rng.randint(1, 8))),
+                maybe(rng, rng.choice(["Yes", "No"])),
+                maybe(rng, str(rng.choice([5, 10, 20]))),
+                maybe(rng, rng.choice(["Rooftop", "Tower", "Attic"])),
+                maybe(rng, f"{rng.randint(5, 120)} ft"),
+                maybe(rng, "2025-03-01"),
+                maybe(rng, "2025-06-15"),
+                maybe(rng, "2025-09-01", 0.05),
+                maybe(rng, f"2A{rng.randint(1000, 9999)}-X", 0.2),
+                maybe(rng, "https://fccid.io/2AXXX-1", 0.2),
+                maybe(rng, "Notes & <things>", 0.4),
+            ])
+
+def ensure_sheets(workdir: str, size: int, seed: int, gk) -> tuple:
+    p_rows, i_rows = size - size // 4, size // 4
+    p_path = os.path.join(workdir, f"prospective-{size}-{seed}.csv")
+    i_path = os.path.join(workdir, f"installed-{size}-{seed}.csv")
+    rng = random.Random(seed * 1_000_003 + size)
+    if not os.path.exists(p_path):
+        write_prospective_csv(p_path, p_rows, rng, gk)
+    if not os.path.exists(i_path):
+        write_installed_csv(i_path, i_rows, rng, gk)
+    return p_path, i_path
+
+# -----------------------
+# Local HTTP stand-in
+# -----------------------
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def start_server(workdir: str):
+    handler = functools.partial(QuietHandler, directory=workdir)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# -----------------------
+# Stages (run in a child process)
+# -----------------------
+def peak_rss_kb() -> int:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes
+
+class CountingSink:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, s: str) -> int:
+        self.bytes += len(s)
+        return len(s)
+
+def run_child(p_url: str, i_url: str, p_path: str, i_path: str, out_dir: str) -> dict:
+    import generate_kml as gk
+    from concurrent.futures import ThreadPoolExecutor
+
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+    stages = {}
+
+    def stage(name, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        stages[name] = {"seconds": round(time.perf_counter() - t0, 6), "peak_rss_kb": peak_rss_kb()}
+        return result
+
+    def drain(url):
+        stream = gk.SheetStream(url).open()
+        for _ in stream:
+            pass
+        return stream.bytes_in
+
+    def parse():
+        with open(p_path, encoding="utf-8", newline="") as pf, open(i_path, encoding="utf-8", newline="") as inf:
+            return gk.parse_prospective(pf), gk.parse_installed(inf)
+
+    def sections_for(parsed):
+        (p_store, p_skipped), (i_store, i_skipped) = parsed
+        sections = [
+            ["Prospective Nodes", {}, p_store, gk.PROSPECTIVE_CATEGORY_ORDER, None],
+            ["Installed Nodes", {}, i_store, gk.NODE_CLASS_ORDER, None],
+        ]
+        return sections, {"prospective": p_skipped, "installed": i_skipped}
+
+    def sort():
+        for section in sections:
+            section[1] = section[2].folders()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        bytes_in = sum(stage("fetch", lambda: list(pool.map(drain, [p_url, i_url]))))
+    parsed = stage("parse", parse)
+    sections, skipped = sections_for(parsed)
+    stage("sort", sort)
+    style_blocks = gk.StyleRegistry(sections).blocks()
+
+    sink = CountingSink()
+    stage("render", lambda: gk.write_sites_kml(sink, now, style_blocks, sections, skipped))
+
+    out_path = os.path.join(out_dir, "sites.kml")
+
+    def write():
+        with open(out_path, "w", encoding="utf-8", buffering=1 << 16) as f:
+            gk.write_sites_kml(f, now, style_blocks, sections, skipped)
+
+    stage("write", write)
+    return {
+        "rows": {"prospective": len(parsed[0][0]), "installed": len(parsed[1][0])},
+        "bytes_in": bytes_in,
+        "bytes_out": os.path.getsize(out_path),
+        "stages": stages,
+    }
+
+# -----------------------
+# Driver
+# -----------------------
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma-separated total row counts (default {DEFAULT_SIZES})")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workdir", default="", help="where synthetic CSVs are kept (reused between runs)")
+    ap.add_argument("--output", default="bench_output.json")
+    ap.add_argument("--child", nargs=5, metavar=("P_URL", "I_URL", "P_PATH", "I_PATH", "OUT_DIR"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        json.dump(run_child(*args.child), sys.stdout)
+        return
+
+    # Benchmarks measure the full pipeline, not the caches.
+    child_env = dict(os.environ, HTTP_CACHE_DIR="", BUILD_MANIFEST="")
+    os.environ.update(HTTP_CACHE_DIR="", BUILD_MANIFEST="")
+    import generate_kml as gk
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "meshnodes-bench")
+    os.makedirs(workdir, exist_ok=True)
+    server, base_url = start_server(workdir)
+
+    results = []
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            p_path, i_path = ensure_sheets(workdir, size, args.seed, gk)
+            with tempfile.TemporaryDirectory() as out_dir:
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child",
+                     f"{base_url}/{os.path.basename(p_path)}", f"{base_url}/{os.path.basename(i_path)}",
+                     p_path, i_path, out_dir],
+                    env=child_env, capture_output=True, text=True,
+                )
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                sys.exit(f"benchmark child failed for size {size}")
+            result = {"size": size, **json.loads(proc.stdout)}
+            results.append(result)
+            timings = "  ".join(f"{k}={v['seconds']:.3f}s" for k, v in result["stages"].items())
+            print(f"{size:>9} rows  {timings}  peak_rss={result['stages']['write']['peak_rss_kb'] // 1024}MB", file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+if __name__ == "__main__":
+    main()
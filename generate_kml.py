@@ -1,15 +1,45 @@
 #!/usr/bin/env python3
+import argparse
+import codecs
 import csv
+import difflib
+import functools
+import gzip
+import hashlib
+import heapq
 import html
+import http.server
+import io
+import json
+import marshal
+import math
 import os
+import random
+import re
+import shutil
+import subprocess
 import sys
+import time
+import threading
+import tracemalloc
+import urllib.error
 import urllib.request
+import zipfile
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
+try:
+    import brotli  # optional: br variants for --serve
+except ImportError:
+    brotli = None
+
 # -----------------------
 # High-level configuration
 # -----------------------
-DATASET_NAME = "FLG/TwiceAsNice MeshCore Site Map"
+DATASET_NAME = os.environ.get("DATASET_NAME", "").strip() or "FLG/TwiceAsNice MeshCore Site Map"
 NETWORKLINK_NAME = f"{DATASET_NAME} (Live)"
 
 PROSPECTIVE_CSV_URL = os.environ.get("PROSPECTIVE_CSV_URL", "").strip()
@@ -18,9 +48,177 @@ INSTALLED_CSV_URL = os.environ.get("INSTALLED_CSV_URL", "").strip()
 OUTPUT_KML = "sites.kml"
 OUTPUT_NETWORKLINK = "networklink.kml"
 DATASET_URL = os.environ.get("DATASET_URL", "").strip()
+SITE_BASE_URL = os.environ.get("SITE_BASE_URL", "").strip() or "https://txkbaldlaw.github.io/meshnodes-site-map/"
+
+# Federation: DATASETS_FILE is a JSON list of regional datasets, each
+#   {"name": ..., "prospective_url": ..., "installed_url": ..., "output_prefix": "ntx"}
+# (optionally "dataset_url"). Every dataset is built by its own child process, at most
+# DATASETS_MAX_WORKERS at once, into its output_prefix directory (with its own .cache), and
+# OUTPUT_NETWORKLINK becomes a master document linking every region's sites.kml.
+DATASETS_FILE = os.environ.get("DATASETS_FILE", "").strip()
+DATASETS_MAX_WORKERS = int(os.environ.get("DATASETS_MAX_WORKERS", "0")) or os.cpu_count() or 1
+
+# Live delta updates: each build diffs its placemarks against the previous build (installed
+# rows keyed by Node ID, prospective rows by Name) and writes OUTPUT_UPDATE, a
+# <NetworkLinkControl><Update> holding only the Create/Change/Delete operations.
+# OUTPUT_LIVE_NETWORKLINK polls that file every REFRESH_SECONDS and reloads the full sites.kml
+# every FULL_REFRESH_SECONDS, which resyncs clients that missed an update. Clients keep seeing
+# the same update until the next build, so placemark and folder operations are safe to apply
+# twice (creates delete the id first); styles can't be deleted, so a replay re-adds identical
+# copies of any new ones. OUTPUT_UPDATE="" disables it, along with the placemark/folder ids.
+OUTPUT_UPDATE = os.environ.get("OUTPUT_UPDATE", "update.kml").strip()
+OUTPUT_LIVE_NETWORKLINK = os.environ.get("OUTPUT_LIVE_NETWORKLINK", "networklink-live.kml").strip()
+UPDATE_SNAPSHOT = os.environ.get("UPDATE_SNAPSHOT", ".cache/update-snapshot.json").strip()
+FULL_REFRESH_SECONDS = int(os.environ.get("FULL_REFRESH_SECONDS", "21600"))
+
+# Optional GeoJSON FeatureCollection for web maps, written from the same parsed rows as the
+# KML. Properties are the description fields (by label) plus name, layer, folder, style key,
+# marker-color/marker-opacity and icon. OUTPUT_GEOJSON="" (default) skips it.
+OUTPUT_GEOJSON = os.environ.get("OUTPUT_GEOJSON", "").strip()
+
+# Only the styles some placemark or cluster uses are emitted. OUTPUT_STYLES (e.g. "styles.kml")
+# moves them out of sites.kml into their own document beside it, referenced as styles.kml#id,
+# so clients cache them across refreshes; "" (default) keeps them inline. The KMZ always
+# carries its own. STYLE_HIGHLIGHT_SCALE > 0 makes each style a StyleMap whose highlight state
+# draws the icon and label that many times larger.
+OUTPUT_STYLES = os.environ.get("OUTPUT_STYLES", "").strip()
+STYLE_HIGHLIGHT_SCALE = float(os.environ.get("STYLE_HIGHLIGHT_SCALE", "0") or 0)
+
+# Every output is written to a temp file beside it and renamed into place, so readers see the
+# old file or the new one, never a torn write; OUTPUT_FSYNC=1 also fsyncs each file and its
+# directory around the rename. OUTPUT_VERSIONS_DIR makes whole builds atomic: each build goes
+# into a fresh OUTPUT_VERSIONS_DIR/<time>-<hash>/ (outputs plus a manifest.json) and the
+# OUTPUT_VERSIONS_DIR/current symlink is flipped to it in one rename. The newest
+# OUTPUT_KEEP_VERSIONS builds are kept. Output paths must be relative in that mode.
+OUTPUT_FSYNC = os.environ.get("OUTPUT_FSYNC", "").strip().lower() in ("1", "true", "yes")
+OUTPUT_VERSIONS_DIR = os.environ.get("OUTPUT_VERSIONS_DIR", "").strip()
+OUTPUT_KEEP_VERSIONS = int(os.environ.get("OUTPUT_KEEP_VERSIONS", "3"))
+
+# Every dropped row goes to a rejects report written in the same pass as sites.kml: sheet,
+# row number as shown in the spreadsheet, offending column, reason code and the cell value.
+# Set either path to "" to skip that format.
+OUTPUT_REJECTS_CSV = os.environ.get("OUTPUT_REJECTS_CSV", "rejects.csv").strip()
+OUTPUT_REJECTS_JSON = os.environ.get("OUTPUT_REJECTS_JSON", "rejects.json").strip()
+
+# Optional zipped output: doc.kml plus every referenced icon, hrefs rewritten to the
+# bundled copies. OUTPUT_KMZ="" (default) skips it; NETWORKLINK_USE_KMZ=1 points the
+# NetworkLink at the KMZ instead of the plain KML when DATASET_URL isn't set.
+OUTPUT_KMZ = os.environ.get("OUTPUT_KMZ", "").strip()
+NETWORKLINK_USE_KMZ = os.environ.get("NETWORKLINK_USE_KMZ", "").strip().lower() in ("1", "true", "yes")
+LOCAL_ICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "img")  # published as SITE_BASE_URL + "img/"
+ICON_FETCH_TIMEOUT = float(os.environ.get("ICON_FETCH_TIMEOUT", "15"))
+
+# Optional Region/LOD tiled output: a quadtree over all placemarks, one KML per tile, each
+# tile holding at most TILE_MAX_PLACEMARKS pins (spread across the tile) and NetworkLinks to
+# its children. Clients only fetch tiles in view. TILES_DIR="" (default) skips it; the entry
+# point is TILES_DIR/root.kml.
+TILES_DIR = os.environ.get("TILES_DIR", "").strip()
+TILE_MAX_PLACEMARKS = int(os.environ.get("TILE_MAX_PLACEMARKS", "256"))
+TILE_MAX_DEPTH = int(os.environ.get("TILE_MAX_DEPTH", "10"))
+TILE_MIN_LOD_PIXELS = int(os.environ.get("TILE_MIN_LOD_PIXELS", "128"))
+
+# Optional clustering for sites.kml/sites.kmz: comma-separated grid cell sizes in degrees,
+# coarsest first, each a whole multiple of the next (e.g. "0.4,0.1,0.025"). A cell with at
+# least CLUSTER_MIN_POINTS pins becomes one count placemark while the cell spans fewer than
+# CLUSTER_LOD_PIXELS on screen; zooming in hands over to the next level, then to the pins.
+CLUSTER_LEVELS = [float(s) for s in os.environ.get("CLUSTER_LEVELS", "").split(",") if s.strip()]
+CLUSTER_MIN_POINTS = int(os.environ.get("CLUSTER_MIN_POINTS", "5"))
+CLUSTER_LOD_PIXELS = int(os.environ.get("CLUSTER_LOD_PIXELS", "256"))
+CLUSTER_ICON_URL = "http://maps.google.com/mapfiles/kml/shapes/placemark_circle.png"
+
+# Duplicate detection (off by default). With DEDUP_RADIUS_METERS set, two pins from either
+# sheet within that distance whose names are at least DEDUP_NAME_SIMILARITY alike (0-1, on
+# lowercased letters and digits) are taken to be the same site, as is a prospective row whose
+# "Installed Node Name" matches an installed "Node Name" at any distance. Installed rows are
+# kept over prospective ones, earlier rows over later ones. DEDUP_ACTION="annotate" notes the
+# match on both pins; "fold" drops the duplicate pin and lists it on the kept one. Every
+# matched pair goes to OUTPUT_DUPLICATES_CSV.
+DEDUP_RADIUS_METERS = float(os.environ.get("DEDUP_RADIUS_METERS", "0") or 0)
+DEDUP_NAME_SIMILARITY = float(os.environ.get("DEDUP_NAME_SIMILARITY", "0.8"))
+DEDUP_ACTION = os.environ.get("DEDUP_ACTION", "annotate").strip().lower()
+OUTPUT_DUPLICATES_CSV = os.environ.get("OUTPUT_DUPLICATES_CSV", "duplicates.csv").strip()
+
+# Optional link-budget layer: installed nodes (except LINK_EXCLUDE_STATUSES) within LINK_MAX_KM
+# of each other, found through the spatial index rather than an all-pairs loop, get a free-space
+# path loss at LINK_FREQUENCY_MHZ. Received power is LINK_TX_POWER_DBM plus both antenna gains
+# ("Antenna Gain" column in dBi, "dBd" values converted, LINK_DEFAULT_GAIN_DBI when blank) minus
+# that loss and LINK_EXTRA_LOSS_DB, a flat allowance for the terrain, clutter and fading free
+# space ignores. The margin over LINK_RX_SENSITIVITY_DBM picks a LINK_QUALITY tier; links below
+# the last tier are dropped. Drawn as a "Links" folder of LineStrings in sites.kml;
+# LINK_MAX_KM=0 (default) skips it.
+LINK_MAX_KM = float(os.environ.get("LINK_MAX_KM", "0") or 0)
+LINK_FREQUENCY_MHZ = float(os.environ.get("LINK_FREQUENCY_MHZ", "910.525"))
+LINK_TX_POWER_DBM = float(os.environ.get("LINK_TX_POWER_DBM", "22"))
+LINK_RX_SENSITIVITY_DBM = float(os.environ.get("LINK_RX_SENSITIVITY_DBM", "-125"))
+LINK_DEFAULT_GAIN_DBI = float(os.environ.get("LINK_DEFAULT_GAIN_DBI", "2.15"))
+LINK_EXTRA_LOSS_DB = float(os.environ.get("LINK_EXTRA_LOSS_DB", "20"))
+LINK_EXCLUDE_STATUSES = [s.strip() for s in os.environ.get("LINK_EXCLUDE_STATUSES", "Decommissioned").split(",") if s.strip()]
+LINK_QUALITY = [  # (minimum margin dB, tier, KML line color, width), strongest first
+    (20, "Strong", "ff00ff00", 3),
+    (10, "Good", "ff00ffff", 2),
+    (0, "Marginal", "ff0000ff", 1),
+]
+
+# Latitude/Longitude cells may be decimal, comma-decimal ("32,7512") or DMS ("32°45'30\"N",
+# "N 32 45.5"). A row whose coordinates were entered the wrong way round is flipped back when
+# a hemisphere letter or the ±90 range says so, or when only the swapped pair falls inside
+# COORD_BBOX ("west,south,east,north", unset by default). Rows are validated in batches of
+# VALIDATE_BATCH_ROWS; every dropped row gets a reason code instead of a bare counter.
+COORD_BBOX = [float(s) for s in os.environ.get("COORD_BBOX", "").split(",") if s.strip()]
+VALIDATE_BATCH_ROWS = 4096
 
 REFRESH_SECONDS = int(os.environ.get("REFRESH_SECONDS", "600"))
 
+# Sheets are downloaded concurrently; each source gets its own timeout
+# (falls back to FETCH_TIMEOUT_SECONDS) and the pool never exceeds FETCH_MAX_WORKERS.
+FETCH_TIMEOUT_SECONDS = float(os.environ.get("FETCH_TIMEOUT_SECONDS", "60"))
+FETCH_MAX_WORKERS = int(os.environ.get("FETCH_MAX_WORKERS", "4"))
+FETCH_TIMEOUTS = {
+    "prospective": float(os.environ.get("PROSPECTIVE_FETCH_TIMEOUT", FETCH_TIMEOUT_SECONDS)),
+    "installed": float(os.environ.get("INSTALLED_FETCH_TIMEOUT", FETCH_TIMEOUT_SECONDS)),
+}
+
+# On-disk conditional-GET cache (ETag / Last-Modified / SHA-256 of the body), keyed by URL.
+# Set HTTP_CACHE_DIR="" to always do a plain download.
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", ".cache/http").strip()
+FETCH_CHUNK_BYTES = 64 * 1024
+
+# Content-addressed builds: the manifest records a hash of the normalized sheets plus the
+# styling config. When a run hashes to the same value nothing is written and the script
+# exits with EXIT_UNCHANGED so the deploy can be skipped. BUILD_MANIFEST="" disables this;
+# FORCE_BUILD=1 ignores the stored manifest for one run.
+BUILD_MANIFEST = os.environ.get("BUILD_MANIFEST", ".cache/build-manifest.json").strip()
+FORCE_BUILD = os.environ.get("FORCE_BUILD", "").strip().lower() in ("1", "true", "yes")
+EXIT_UNCHANGED = 3
+
+# Build metrics: per-stage wall time, row counts and bytes in/out. METRICS_FILE="-" prints
+# JSON to stderr, any other value writes it to that path; METRICS_PROM_FILE writes the same
+# numbers in Prometheus textfile format for node-exporter. METRICS_TRACEMALLOC=1 also records
+# the tracemalloc peak per stage (roughly doubles build time, so it's off by default).
+METRICS_FILE = os.environ.get("METRICS_FILE", "").strip()
+METRICS_PROM_FILE = os.environ.get("METRICS_PROM_FILE", "").strip()
+METRICS_TRACEMALLOC = os.environ.get("METRICS_TRACEMALLOC", "").strip().lower() in ("1", "true", "yes")
+
+# --watch keeps the process running and polls the sheets every WATCH_INTERVAL_SECONDS (with
+# +/-WATCH_JITTER spread), holding parsed sheets, rendered placemarks and HTTP validators in
+# memory between builds. Failed polls back off exponentially, up to WATCH_MAX_BACKOFF_SECONDS.
+WATCH_INTERVAL_SECONDS = float(os.environ.get("WATCH_INTERVAL_SECONDS", "60"))
+WATCH_JITTER = float(os.environ.get("WATCH_JITTER", "0.1"))
+WATCH_MAX_BACKOFF_SECONDS = float(os.environ.get("WATCH_MAX_BACKOFF_SECONDS", "3600"))
+
+# --serve [HOST:]PORT runs the watch loop plus a small HTTP server for self-hosted setups. It
+# serves the latest build from memory (every output, tiles, and the icons as /img/...) with
+# gzip (and br, when the brotli module is installed) variants compressed once per build,
+# strong content-hash ETags, If-None-Match -> 304 and single byte ranges.
+SERVE_CACHE_CONTROL = os.environ.get("SERVE_CACHE_CONTROL", "no-cache").strip()
+
+# Rendered <Placemark> fragments from the last build, keyed by a hash of everything that goes
+# into one (name, coordinates, style, description values). Unchanged rows are copied from
+# here instead of re-escaped; entries not used by a build are dropped when it's saved.
+# Stored with marshal (fast for a big str dict, and it's only ever our own file).
+# PLACEMARK_CACHE="" disables it.
+PLACEMARK_CACHE = os.environ.get("PLACEMARK_CACHE", ".cache/placemarks.marshal").strip()
+
 # -----------------------
 # Prospective node styling
 # -----------------------
@@ -87,12 +285,76 @@ INSTALLED_STATUS_ICONS = {
     "In Service": "https://txkbaldlaw.github.io/meshnodes-site-map/img/mc-icon.png",
 }
 
+# -----------------------
+# Shared styles
+# -----------------------
+# Style id prefix -> (colors, icons, default icon). A key missing from its color map still
+# gets a style (DEFAULT_STYLE_COLOR with the default icon) rather than an unstyled pin.
+DEFAULT_STYLE_COLOR = "ffffffff"
+STYLE_FAMILIES = {
+    "p-cat-": (PROSPECTIVE_CATEGORY_COLORS, PROSPECTIVE_CATEGORY_ICONS, PROSPECTIVE_DEFAULT_ICON_URL),
+    "i-status-": (INSTALLED_STATUS_COLORS, INSTALLED_STATUS_ICONS, INSTALLED_DEFAULT_ICON_URL),
+    "p-cluster-": (PROSPECTIVE_CATEGORY_COLORS, {}, CLUSTER_ICON_URL),
+    "i-cluster-": (INSTALLED_STATUS_COLORS, {}, CLUSTER_ICON_URL),
+}
+
 # -----------------------
 # Required columns
 # -----------------------
 PROSPECTIVE_REQUIRED_COLUMNS = ["Name", "Latitude", "Longitude", "Category"]
 INSTALLED_REQUIRED_COLUMNS = ["Node ID", "Node Name", "Latitude", "Longitude", "Node Class", "Node Status"]
 
+# -----------------------
+# Description fields
+# -----------------------
+# (column, label, kind) in display order. `column` may be a tuple of alternatives; the first
+# non-empty one wins. Kinds: "text", "link" (clickable URL), "date" (ISO 8601 when parseable).
+# Columns missing from the sheet are dropped once per build, so adding a column here is all
+# it takes to show it.
+PROSPECTIVE_FIELDS = [
+    ("Name", "Name", "text"),
+    ("Category", "Category", "text"),
+    ("Street Address", "Street Address", "text"),
+    ("Proposed By", "Proposed By", "text"),
+    ("Assigned To", "Assigned To", "text"),
+    ("Node Owner", "Node Owner", "text"),
+    ("Installed Node Name", "Installed Node Name", "text"),
+    ("FCC ID", "FCC ID", "text"),
+    ("FCC Link", "FCC Link", "link"),
+    ("Notes", "Notes", "text"),
+]
+
+INSTALLED_FIELDS = [
+    ("Node Name", "Node Name", "text"),
+    ("Node ID", "Node ID", "text"),
+    ("Node Class", "Node Class", "text"),
+    ("Node Status", "Node Status", "text"),
+    # Contact / ownership
+    ("Node Owner", "Node Owner", "text"),
+    ("Site Owner", "Site Owner", "text"),
+    ("Site Contact Name", "Site Contact Name", "text"),
+    ("Site Contact Phone", "Site Contact Phone", "text"),
+    ("Site Contact Email", "Site Contact Email", "text"),
+    # Optional tech/inventory fields (present if you add them; safe if absent)
+    ("Node Baseboard", "Node Baseboard", "text"),
+    ("Antenna", "Antenna", "text"),
+    ("Antenna Gain", "Antenna Gain", "text"),
+    ("Battery Type", "Battery Type", "text"),
+    ("Battery Quantity", "Battery Quantity", "text"),
+    ("Solar", "Solar", "text"),
+    ("Solar Panel Wattage", "Solar Panel Wattage", "text"),
+    ("Installation Type", "Installation Type", "text"),
+    ("Installed Elevation", "Installed Elevation", "text"),
+    ("Installed Date", "Installed Date", "date"),
+    (("Last Updated Date", "Late Updated Date"), "Last Updated Date", "date"),
+    ("Decommissioned Date", "Decommissioned Date", "date"),
+    ("FCC ID", "FCC ID", "text"),
+    ("FCC Link", "FCC Link", "link"),
+    ("Notes", "Notes", "text"),
+]
+
+DATE_INPUT_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d"]
+
 # -----------------------
 # Helpers
 # -----------------------
@@ -100,18 +362,351 @@ def die(msg: str) -> None:
     print(f"ERROR: {msg}", file=sys.stderr)
     sys.exit(1)
 
-def fetch_csv(url: str) -> str:
-    with urllib.request.urlopen(url) as r:
-        return r.read().decode("utf-8", errors="replace")
+def http_cache_paths(url: str) -> tuple:
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(HTTP_CACHE_DIR, f"{key}.json"), os.path.join(HTTP_CACHE_DIR, f"{key}.csv")
 
-def safe_float(v):
-    try:
-        return float(v)
-    except (TypeError, ValueError):
+_http_meta = {}  # url -> validators, so a long-running process only reads them from disk once
+
+def load_http_cache(url: str):
+    """Cached validators for `url`, or None. The body itself is streamed from disk on a 304."""
+    if not HTTP_CACHE_DIR:
         return None
+    meta_path, body_path = http_cache_paths(url)
+    meta = _http_meta.get(url)
+    if meta is None:
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = _http_meta[url] = json.load(f)
+        except (OSError, ValueError):
+            return None
+    if not os.path.exists(body_path):
+        return None
+    return meta
+
+def store_http_cache_meta(url: str, meta: dict) -> None:
+    meta_path, _ = http_cache_paths(url)
+    _http_meta[url] = meta  # keyed by the URL hash on disk; the (secret) URL itself is never stored
+    with atomic_output(meta_path) as f:
+        json.dump(meta, f)
+
+def fsync_dir(path: str) -> None:
+    if os.name != "posix":
+        return  # directories can't be opened for fsync elsewhere
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_output(path: str, mode: str = "w", **kwargs):
+    """Write to a temp file beside `path` that replaces it only once the block completes, so
+    readers see the old file or the new one, never a partial write."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if "b" not in mode:
+        kwargs.setdefault("encoding", "utf-8")
+    try:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+            if OUTPUT_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if OUTPUT_FSYNC:
+            fsync_dir(os.path.dirname(path))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def replace_if_changed(path: str, text: str) -> bool:
+    """Atomically write `text` to `path` unless it already holds exactly that."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    with atomic_output(path) as f:
+        f.write(text)
+    return True
+
+def iter_decoded_lines(chunks):
+    """Incrementally decode UTF-8 byte chunks into text lines (endings kept) for the csv module."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        cut = pending.rfind("\n") + 1
+        if cut:
+            complete, pending = pending[:cut], pending[cut:]
+            for line in complete.split("\n")[:-1]:
+                yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+class SheetStream:
+    """CSV text lines for one sheet, read straight off the HTTP response (or the cache on a 304).
+
+    open() issues the (conditional) request; iterating yields lines as bytes arrive, hashing
+    and teeing them into the HTTP cache on the way through. Once exhausted, `unchanged` says
+    whether the body matched the cached copy and `input_digest` is the hash of the normalized
+    text (line endings, trailing whitespace and blank rows don't change the map).
+    """
+
+    def __init__(self, url: str, timeout: float = FETCH_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+        self.not_modified = False
+        self.unchanged = False
+        self.input_digest = ""
+        self.bytes_in = 0
+        self._cached = None
+        self._response = None
+
+    def open(self):
+        self._cached = load_http_cache(self.url)
+        req = urllib.request.Request(self.url)
+        if self._cached:
+            if self._cached.get("etag"):
+                req.add_header("If-None-Match", self._cached["etag"])
+            if self._cached.get("last_modified"):
+                req.add_header("If-Modified-Since", self._cached["last_modified"])
+        try:
+            self._response = urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and self._cached and self._cached.get("input_sha256"):
+                self.not_modified = self.unchanged = True
+                self.input_digest = self._cached["input_sha256"]
+                return self
+            raise
+        return self
+
+    def __iter__(self):
+        if self._response is None and not self.not_modified:
+            self.open()
+        if self.not_modified:
+            _, body_path = http_cache_paths(self.url)
+            with open(body_path, "rb") as f:
+                yield from iter_decoded_lines(iter(lambda: f.read(FETCH_CHUNK_BYTES), b""))
+            return
+
+        r = self._response
+        raw = hashlib.sha256()
+        normalized = hashlib.sha256()
+        tee = tmp_path = None
+        if HTTP_CACHE_DIR:
+            os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{http_cache_paths(self.url)[1]}.{os.getpid()}.{id(self)}.tmp"
+            tee = open(tmp_path, "wb")
 
-def opt(row: dict, cols: set, col: str) -> str:
-    return (row.get(col) or "").strip() if col in cols else ""
+        def chunks():
+            while True:
+                chunk = r.read(FETCH_CHUNK_BYTES)
+                if not chunk:
+                    return
+                self.bytes_in += len(chunk)
+                raw.update(chunk)
+                if tee:
+                    tee.write(chunk)
+                yield chunk
+
+        try:
+            with r:
+                for line in iter_decoded_lines(chunks()):
+                    stripped = line.rstrip()
+                    if stripped.strip(", \t"):
+                        normalized.update(stripped.encode("utf-8") + b"\n")
+                    yield line
+            digest = raw.hexdigest()
+            self.input_digest = normalized.hexdigest()
+            self.unchanged = bool(self._cached) and self._cached.get("sha256") == digest
+            if tee:
+                tee.close()
+                os.replace(tmp_path, http_cache_paths(self.url)[1])
+                store_http_cache_meta(self.url, {
+                    "etag": r.headers.get("ETag") or "",
+                    "last_modified": r.headers.get("Last-Modified") or "",
+                    "sha256": digest,
+                    "input_sha256": self.input_digest,
+                })
+        finally:
+            if tee and not tee.closed:
+                tee.close()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def fetch_and_parse(url: str, timeout: float, parser) -> tuple:
+    stream = SheetStream(url, timeout).open()
+    if stream.not_modified:
+        return stream, None  # parse deferred until we know the build isn't a no-op
+    return stream, parser(stream)
+
+def fetch_all(sources: dict, parsers: dict):
+    """Download and parse every source (name -> url) at once, yielding (name, stream, parsed)
+    as each one finishes. Rows are parsed as they stream in, so parsing overlaps the download.
+    `parsed` is None for a 304; the caller parses the cached body only if it needs it.
+    """
+    workers = max(1, min(FETCH_MAX_WORKERS, len(sources)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_and_parse, url, FETCH_TIMEOUTS.get(name, FETCH_TIMEOUT_SECONDS), parsers[name]): name
+            for name, url in sources.items()
+        }
+        for fut in as_completed(futures):
+            name = futures[fut]
+            try:
+                stream, parsed = fut.result()
+            except Exception as e:
+                die(f"Failed to fetch {name} sheet: {e}")
+            yield name, stream, parsed
+
+def output_dir() -> str:
+    """Where the published outputs live: the `current` symlink in versioned mode, else cwd."""
+    return os.path.join(OUTPUT_VERSIONS_DIR, "current") if OUTPUT_VERSIONS_DIR else ""
+
+def new_version_dir(now: str, build_hash: str) -> str:
+    stamp = datetime.strptime(now, "%Y-%m-%d %H:%M:%SZ").strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(OUTPUT_VERSIONS_DIR, f"{stamp}-{build_hash[:12]}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def publish_version(version_dir: str) -> None:
+    """Point OUTPUT_VERSIONS_DIR/current at `version_dir` in one rename, then prune old builds."""
+    if OUTPUT_FSYNC:
+        fsync_dir(version_dir)
+    link = output_dir()
+    tmp = f"{link}.{os.getpid()}.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(os.path.basename(version_dir), tmp)
+    os.replace(tmp, link)
+    if OUTPUT_FSYNC:
+        fsync_dir(OUTPUT_VERSIONS_DIR)
+    versions = sorted(
+        e.name for e in os.scandir(OUTPUT_VERSIONS_DIR)
+        if e.is_dir(follow_symlinks=False) and e.name != os.path.basename(version_dir)
+    )
+    for name in versions[:max(0, len(versions) - (OUTPUT_KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(OUTPUT_VERSIONS_DIR, name), ignore_errors=True)
+
+def build_outputs() -> list:
+    live = (OUTPUT_UPDATE, OUTPUT_LIVE_NETWORKLINK) if OUTPUT_UPDATE else ()
+    dedup = (OUTPUT_DUPLICATES_CSV,) if DEDUP_RADIUS_METERS else ()
+    return [p for p in (
+        OUTPUT_KML, OUTPUT_NETWORKLINK, OUTPUT_STYLES, OUTPUT_KMZ, TILES_DIR, OUTPUT_GEOJSON, OUTPUT_REJECTS_CSV, OUTPUT_REJECTS_JSON,
+        *dedup, *live,
+    ) if p]
+
+def config_fingerprint() -> str:
+    """Hash of everything besides the sheets that shapes the output (incl. this script)."""
+    h = hashlib.sha256()
+    with open(os.path.abspath(__file__), "rb") as f:
+        h.update(f.read())
+    config = {
+        "dataset_name": DATASET_NAME,
+        "dataset_url": DATASET_URL,
+        "site_base_url": SITE_BASE_URL,
+        "refresh_seconds": REFRESH_SECONDS,
+        "full_refresh_seconds": FULL_REFRESH_SECONDS,
+        "outputs": build_outputs(),
+        "networklink_use_kmz": NETWORKLINK_USE_KMZ,
+        "style_highlight_scale": STYLE_HIGHLIGHT_SCALE,
+        "tiles": [TILE_MAX_PLACEMARKS, TILE_MAX_DEPTH, TILE_MIN_LOD_PIXELS],
+        "clusters": [CLUSTER_LEVELS, CLUSTER_MIN_POINTS, CLUSTER_LOD_PIXELS],
+        "coord_bbox": COORD_BBOX,
+        "dedup": [DEDUP_RADIUS_METERS, DEDUP_NAME_SIMILARITY, DEDUP_ACTION],
+        "links": [LINK_MAX_KM, LINK_FREQUENCY_MHZ, LINK_TX_POWER_DBM, LINK_RX_SENSITIVITY_DBM,
+                  LINK_DEFAULT_GAIN_DBI, LINK_EXTRA_LOSS_DB, LINK_EXCLUDE_STATUSES, LINK_QUALITY],
+        "prospective_colors": PROSPECTIVE_CATEGORY_COLORS,
+        "prospective_icons": PROSPECTIVE_CATEGORY_ICONS,
+        "installed_colors": INSTALLED_STATUS_COLORS,
+        "installed_icons": INSTALLED_STATUS_ICONS,
+        "prospective_fields": PROSPECTIVE_FIELDS,
+        "installed_fields": INSTALLED_FIELDS,
+    }
+    h.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    # The KMZ bundles our own icons straight from disk.
+    for root, dirs, files in os.walk(LOCAL_ICON_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            h.update(f"\0{os.path.relpath(path, LOCAL_ICON_DIR)}\0".encode("utf-8"))
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+def inputs_fingerprint(digests: dict, config_hash: str) -> str:
+    h = hashlib.sha256(config_hash.encode("ascii"))
+    for name in sorted(digests):
+        h.update(f"\0{name}\0{digests[name]}".encode("utf-8"))
+    return h.hexdigest()
+
+def load_manifest() -> dict:
+    if not BUILD_MANIFEST or FORCE_BUILD:
+        return {}
+    try:
+        with open(BUILD_MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(build_hash: str, now: str, path: str = BUILD_MANIFEST) -> None:
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with atomic_output(path) as f:
+        json.dump({"build_hash": build_hash, "built_at": now, "outputs": build_outputs()}, f, indent=2)
+
+def column_index(header: list) -> dict:
+    # Like csv.DictReader, a repeated header name resolves to its last column.
+    return {name.strip(): i for i, name in enumerate(header)}
+
+def cell(row: list, i: int) -> str:
+    return row[i].strip() if i < len(row) else ""
+
+@functools.lru_cache(maxsize=4096)  # sheets repeat the same handful of dates
+def normalize_date(value: str) -> str:
+    for fmt in DATE_INPUT_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return value
+
+def compile_fields(fields: list, cols: dict) -> list:
+    """Resolve a field schema against a sheet header: [(column_indices, label, kind)],
+    with fields whose columns are all absent dropped."""
+    compiled = []
+    for column, label, kind in fields:
+        names = column if isinstance(column, tuple) else (column,)
+        idxs = tuple(cols[n] for n in names if n in cols)
+        if idxs:
+            compiled.append((idxs, label, kind))
+    return compiled
+
+def render_description(labels: list, values: list, footer: str) -> str:
+    """`labels` is [(label_html, kind)] parallel to `values`; empty values are left out."""
+    parts = []
+    escape = html.escape
+    for (label, kind), value in zip(labels, values):
+        if not value:
+            continue
+        if kind == "text":
+            parts.append(f"{label} {escape(value)}")
+        elif kind == "link":
+            u = escape(value, quote=True)
+            parts.append(f'{label} <a href="{u}" target="_blank">{u}</a>')
+        else:  # date
+            parts.append(f"{label} {escape(normalize_date(value))}")
+    parts.append(footer)
+    return "<br/>".join(parts)
+
+def description_footer() -> str:
+    # No build timestamp here: it lives in the document header so unchanged placemarks stay
+    # byte-identical between builds (and can come straight from the placemark cache).
+    return f"<i>Refresh:</i> every {REFRESH_SECONDS // 60} minutes"
 
 def sort_key_with_preferred_order(value: str, preferred: list) -> tuple:
     try:
@@ -123,297 +718,1700 @@ def style_id(prefix: str, name: str) -> str:
     # KML id can contain spaces, but keeping it predictable helps debugging.
     return f"{prefix}{name}"
 
-def build_style_block(style_id_str: str, color: str, icon_url: str) -> str:
+def icon_style_xml(style_id_str: str, color: str, icon_url: str, icon_scale: float, label_scale: float) -> str:
     return f"""
     <Style id="{html.escape(style_id_str)}">
       <IconStyle>
         <color>{color}</color>
-        <scale>1.5</scale>
+        <scale>{icon_scale:g}</scale>
         <Icon><href>{html.escape(icon_url)}</href></Icon>
       </IconStyle>
-      <LabelStyle><scale>1.2</scale></LabelStyle>
+      <LabelStyle><scale>{label_scale:g}</scale></LabelStyle>
     </Style>"""
 
-def main() -> None:
-    if not PROSPECTIVE_CSV_URL:
-        die("PROSPECTIVE_CSV_URL env var is required")
-    if not INSTALLED_CSV_URL:
-        die("INSTALLED_CSV_URL env var is required")
+def build_style_block(style_id_str: str, color: str, icon_url: str) -> str:
+    """One shared style; with STYLE_HIGHLIGHT_SCALE, a normal/highlight pair behind a
+    <StyleMap> that carries the shared id, so placemarks reference it the same way."""
+    if not STYLE_HIGHLIGHT_SCALE:
+        return icon_style_xml(style_id_str, color, icon_url, 1.5, 1.2)
+    k = STYLE_HIGHLIGHT_SCALE
+    sid = html.escape(style_id_str)
+    return (
+        icon_style_xml(f"{style_id_str}-normal", color, icon_url, 1.5, 1.2)
+        + icon_style_xml(f"{style_id_str}-highlight", color, icon_url, round(1.5 * k, 3), round(1.2 * k, 3))
+        + f"""
+    <StyleMap id="{sid}">
+      <Pair><key>normal</key><styleUrl>#{sid}-normal</styleUrl></Pair>
+      <Pair><key>highlight</key><styleUrl>#{sid}-highlight</styleUrl></Pair>
+    </StyleMap>"""
+    )
 
-    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+def dominant_key(counts: dict, key_order: list) -> str:
+    """A cluster's most common style key; ties go to the preferred-order winner."""
+    keys = sorted(counts, key=lambda k: sort_key_with_preferred_order(k, key_order))
+    return max(keys, key=lambda k: counts[k])
 
-    # -----------------------
-    # Read Prospective sheet
-    # -----------------------
-    p_text = fetch_csv(PROSPECTIVE_CSV_URL)
-    p_reader = csv.DictReader(p_text.splitlines())
-    p_cols = set(p_reader.fieldnames or [])
-    missing_p = [c for c in PROSPECTIVE_REQUIRED_COLUMNS if c not in p_cols]
-    if missing_p:
-        die(f"Prospective sheet missing required columns: {missing_p}. Found: {sorted(p_cols)}")
-
-    prospective_folders = {}  # category -> list[(sort_key, placemark_xml)]
-    prospective_skipped = 0
-
-    for row in p_reader:
-        name = (row.get("Name") or "").strip()
-        category = (row.get("Category") or "").strip()
-        lat = safe_float(row.get("Latitude"))
-        lon = safe_float(row.get("Longitude"))
-
-        if not name or not category or lat is None or lon is None:
-            prospective_skipped += 1
-            continue
-        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-            prospective_skipped += 1
-            continue
+class StyleRegistry:
+    """The shared styles one build's placemarks and clusters actually reference.
 
-        address = opt(row, p_cols, "Street Address")
-        notes = opt(row, p_cols, "Notes")
-        proposed_by = opt(row, p_cols, "Proposed By")
-        assigned_to = opt(row, p_cols, "Assigned To")
-        node_owner = opt(row, p_cols, "Node Owner")
-        installed_node_name = opt(row, p_cols, "Installed Node Name")
-        fcc_id = opt(row, p_cols, "FCC ID")
-        fcc_link = opt(row, p_cols, "FCC Link")
-
-        desc_parts = [
-            f"<b>Name:</b> {html.escape(name)}",
-            f"<b>Category:</b> {html.escape(category)}",
-        ]
-        if address: desc_parts.append(f"<b>Street Address:</b> {html.escape(address)}")
-        if proposed_by: desc_parts.append(f"<b>Proposed By:</b> {html.escape(proposed_by)}")
-        if assigned_to: desc_parts.append(f"<b>Assigned To:</b> {html.escape(assigned_to)}")
-        if node_owner: desc_parts.append(f"<b>Node Owner:</b> {html.escape(node_owner)}")
-        if installed_node_name: desc_parts.append(f"<b>Installed Node Name:</b> {html.escape(installed_node_name)}")
-        if fcc_id: desc_parts.append(f"<b>FCC ID:</b> {html.escape(fcc_id)}")
-        if fcc_link:
-            u = html.escape(fcc_link, quote=True)
-            desc_parts.append(f'<b>FCC Link:</b> <a href="{u}" target="_blank">{u}</a>')
-        if notes: desc_parts.append(f"<b>Notes:</b> {html.escape(notes)}")
-
-        desc_parts.extend([
-            f"<i>Updated (UTC):</i> {now}",
-            f"<i>Refresh:</i> every {REFRESH_SECONDS // 60} minutes",
-        ])
-        desc = "<br/>".join(desc_parts)
-
-        # Styles are category-based for Prospective
-        p_style = ""
-        if category in PROSPECTIVE_CATEGORY_COLORS:
-            p_style = f"#{style_id('p-cat-', category)}"
-
-        placemark = f"""
-      <Placemark>
-        <name>{html.escape("Mesh: " + name)}</name>
-        {"<styleUrl>"+html.escape(p_style)+"</styleUrl>" if p_style else ""}
-        <description><![CDATA[{desc}]]></description>
-        <Point><coordinates>{lon},{lat}</coordinates></Point>
-      </Placemark>"""
+    Stores intern their style keys while parsing, so this only collects those (plus each
+    cluster's dominant key); colors nothing uses never reach the document.
+    """
 
-        prospective_folders.setdefault(category, []).append((name.lower(), placemark))
+    def __init__(self, sections: list):
+        self.used = set()  # (family, style key)
+        for _, _, store, _, clustering in sections:
+            self.used.update((store.style_family, key) for key in store.style_keys)
+            if clustering:
+                clusters, _, family, key_order = clustering
+                self.used.update((family, dominant_key(counts, key_order)) for *_, counts in clusters)
 
-    # -----------------------
-    # Read Installed sheet
-    # -----------------------
-    i_text = fetch_csv(INSTALLED_CSV_URL)
-    i_reader = csv.DictReader(i_text.splitlines())
-    i_cols = set(i_reader.fieldnames or [])
-    missing_i = [c for c in INSTALLED_REQUIRED_COLUMNS if c not in i_cols]
-    if missing_i:
-        die(f"Installed sheet missing required columns: {missing_i}. Found: {sorted(i_cols)}")
-
-    installed_folders = {}  # node_class -> list[(sort_key, placemark_xml)]
-    installed_skipped = 0
-
-    for row in i_reader:
-        node_id = (row.get("Node ID") or "").strip()
-        node_name = (row.get("Node Name") or "").strip()
-        node_class = (row.get("Node Class") or "").strip()
-        node_status = (row.get("Node Status") or "").strip()
-
-        lat = safe_float(row.get("Latitude"))
-        lon = safe_float(row.get("Longitude"))
-
-        if not node_id or not node_name or not node_class or not node_status or lat is None or lon is None:
-            installed_skipped += 1
-            continue
-        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-            installed_skipped += 1
-            continue
+    def defs(self) -> list:
+        """(style_id, color, icon_url) per referenced style, by family then color-map order."""
+        families = list(STYLE_FAMILIES)
 
-        # Contact / ownership fields you requested
-        node_owner = opt(row, i_cols, "Node Owner")
-        site_owner = opt(row, i_cols, "Site Owner")
-        site_contact_name = opt(row, i_cols, "Site Contact Name")
-        site_contact_phone = opt(row, i_cols, "Site Contact Phone")
-        site_contact_email = opt(row, i_cols, "Site Contact Email")
-
-        # Optional tech/inventory fields (present if you add them; safe if absent)
-        baseboard = opt(row, i_cols, "Node Baseboard")
-        antenna = opt(row, i_cols, "Antenna")
-        antenna_gain = opt(row, i_cols, "Antenna Gain")
-        battery_type = opt(row, i_cols, "Battery Type")
-        battery_qty = opt(row, i_cols, "Battery Quantity")
-        solar = opt(row, i_cols, "Solar")
-        solar_wattage = opt(row, i_cols, "Solar Panel Wattage")
-        install_type = opt(row, i_cols, "Installation Type")
-        install_elev = opt(row, i_cols, "Installed Elevation")
-        installed_date = opt(row, i_cols, "Installed Date")
-        last_updated_date = opt(row, i_cols, "Last Updated Date") or opt(row, i_cols, "Late Updated Date")
-        decommissioned_date = opt(row, i_cols, "Decommissioned Date")
-
-        fcc_id = opt(row, i_cols, "FCC ID")
-        fcc_link = opt(row, i_cols, "FCC Link")
-        notes = opt(row, i_cols, "Notes")
-
-        desc_parts = [
-            f"<b>Node Name:</b> {html.escape(node_name)}",
-            f"<b>Node ID:</b> {html.escape(node_id)}",
-            f"<b>Node Class:</b> {html.escape(node_class)}",
-            f"<b>Node Status:</b> {html.escape(node_status)}",
-        ]
+        def order(used):
+            family, key = used
+            return families.index(family), sort_key_with_preferred_order(key, list(STYLE_FAMILIES[family][0]))
+
+        style_defs = []
+        for family, key in sorted(self.used, key=order):
+            colors, icons, default_icon = STYLE_FAMILIES[family]
+            style_defs.append((style_id(family, key), colors.get(key, DEFAULT_STYLE_COLOR), icons.get(key, default_icon)))
+        return style_defs
+
+    def blocks(self, icon_hrefs: dict = None) -> list:
+        """Style XML for defs(), icon hrefs optionally rewritten (KMZ bundles)."""
+        icon_hrefs = icon_hrefs or {}
+        return [build_style_block(sid, color, icon_hrefs.get(icon_url, icon_url)) for sid, color, icon_url in self.defs()]
+
+# -----------------------
+# Node store
+# -----------------------
+class NodeStore:
+    """Columnar storage for the accepted rows of one sheet.
+
+    Coordinates live in float64 arrays, folder and style keys are interned into small code
+    arrays, and the only strings kept are the display name plus one column per described
+    field (repeated values share one object). Descriptions are rendered on demand, so
+    renderers and analyses all read from here instead of holding per-row dicts or XML.
+    """
+
+    def __init__(self, fields: list, style_family: str, id_prefix: str = ""):
+        self.labels = [(f"<b>{html.escape(label)}:</b>", kind) for _, label, kind in fields]
+        self.field_names = [label for _, label, _ in fields]
+        self.field_idxs = [idxs for idxs, _, _ in fields]
+        self.schema = "\x1e".join(f"{label}\x1d{kind}" for _, label, kind in fields)  # part of every fingerprint
+        self.columns = [[] for _ in fields]
+        self.names = []
+        self.lon = array("d")
+        self.lat = array("d")
+        self.group_codes = array("I")
+        self.groups = []
+        self.style_codes = array("I")
+        self.style_keys = []
+        self.style_urls = []
+        self.style_family = style_family  # STYLE_FAMILIES key; style ids are family + style key
+        self._codes = {}  # (table, value) -> code
+        self._strings = {}
+        self.swapped = 0  # rows whose lat/lon were entered the wrong way round
+        self.id_prefix = id_prefix
+        self.keys = []  # stable per-row key (Node ID / Name) for KML ids
+        self.ids = None  # set by assign_ids(); placemarks and folders carry ids once it is
+        self._index = None
+        self.notes = {}  # record index -> extra description line (duplicate detection)
+        self.hidden = set()  # record indices folded into another pin; left out of every output
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _code(self, table: list, value: str, on_new=None) -> int:
+        key = (id(table), value)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(table)
+            table.append(value)
+            if on_new:
+                on_new(value)
+        return code
+
+    def append(self, row: list, name: str, lon: float, lat: float, group: str, style_key: str, key: str = "") -> int:
+        idx = len(self.names)
+        self.names.append(name)
+        self.keys.append(key or name)
+        self.lon.append(lon)
+        self.lat.append(lat)
+        self.group_codes.append(self._code(self.groups, group))
+        self.style_codes.append(self._code(self.style_keys, style_key, lambda k: self.style_urls.append(f"#{style_id(self.style_family, k)}")))
+        n = len(row)
+        strings = self._strings
+        for column, idxs in zip(self.columns, self.field_idxs):
+            value = ""
+            for i in idxs:
+                if i < n:
+                    value = row[i].strip()
+                    if value:
+                        break
+            column.append(strings.setdefault(value, value))
+        return idx
+
+    def group(self, i: int) -> str:
+        return self.groups[self.group_codes[i]]
 
-        if node_owner: desc_parts.append(f"<b>Node Owner:</b> {html.escape(node_owner)}")
-        if site_owner: desc_parts.append(f"<b>Site Owner:</b> {html.escape(site_owner)}")
-        if site_contact_name: desc_parts.append(f"<b>Site Contact Name:</b> {html.escape(site_contact_name)}")
-        if site_contact_phone: desc_parts.append(f"<b>Site Contact Phone:</b> {html.escape(site_contact_phone)}")
-        if site_contact_email: desc_parts.append(f"<b>Site Contact Email:</b> {html.escape(site_contact_email)}")
-
-        if baseboard: desc_parts.append(f"<b>Node Baseboard:</b> {html.escape(baseboard)}")
-        if antenna: desc_parts.append(f"<b>Antenna:</b> {html.escape(antenna)}")
-        if antenna_gain: desc_parts.append(f"<b>Antenna Gain:</b> {html.escape(antenna_gain)}")
-        if battery_type: desc_parts.append(f"<b>Battery Type:</b> {html.escape(battery_type)}")
-        if battery_qty: desc_parts.append(f"<b>Battery Quantity:</b> {html.escape(battery_qty)}")
-        if solar: desc_parts.append(f"<b>Solar:</b> {html.escape(solar)}")
-        if solar_wattage: desc_parts.append(f"<b>Solar Panel Wattage:</b> {html.escape(solar_wattage)}")
-        if install_type: desc_parts.append(f"<b>Installation Type:</b> {html.escape(install_type)}")
-        if install_elev: desc_parts.append(f"<b>Installed Elevation:</b> {html.escape(install_elev)}")
-        if installed_date: desc_parts.append(f"<b>Installed Date:</b> {html.escape(installed_date)}")
-        if last_updated_date: desc_parts.append(f"<b>Last Updated Date:</b> {html.escape(last_updated_date)}")
-        if decommissioned_date: desc_parts.append(f"<b>Decommissioned Date:</b> {html.escape(decommissioned_date)}")
-
-        if fcc_id: desc_parts.append(f"<b>FCC ID:</b> {html.escape(fcc_id)}")
-        if fcc_link:
-            u = html.escape(fcc_link, quote=True)
-            desc_parts.append(f'<b>FCC Link:</b> <a href="{u}" target="_blank">{u}</a>')
-
-        if notes: desc_parts.append(f"<b>Notes:</b> {html.escape(notes)}")
-
-        desc_parts.extend([
-            f"<i>Updated (UTC):</i> {now}",
-            f"<i>Refresh:</i> every {REFRESH_SECONDS // 60} minutes",
+    def style_key(self, i: int) -> str:
+        return self.style_keys[self.style_codes[i]]
+
+    def style_url(self, i: int) -> str:
+        return self.style_urls[self.style_codes[i]]
+
+    def values(self, i: int) -> list:
+        return [column[i] for column in self.columns]
+
+    def column(self, label: str) -> list:
+        """One described field's values, by label ("" throughout if the sheet lacks it)."""
+        if label not in self.field_names:
+            return [""] * len(self)
+        return self.columns[self.field_names.index(label)]
+
+    def description(self, i: int, footer: str) -> str:
+        note = self.notes.get(i)
+        return render_description(self.labels, self.values(i), f"{note}<br/>{footer}" if note else footer)
+
+    def fingerprint(self, i: int, *context: str) -> bytes:
+        """Hash of record i's rendered inputs plus `context` (style prefix, region, ...)."""
+        text = "\x1f".join([
+            *context, self.schema, self.names[i], self.style_url(i), self.notes.get(i, ""),
+            *[column[i] for column in self.columns],
         ])
-        desc = "<br/>".join(desc_parts)
-
-        # Installed styles are status-based
-        i_style = ""
-        if node_status in INSTALLED_STATUS_COLORS:
-            i_style = f"#{style_id('i-status-', node_status)}"
-
-        placemark = f"""
-      <Placemark>
-       <name>{html.escape("Mesh: " + node_name)}</name>
-        {"<styleUrl>"+html.escape(i_style)+"</styleUrl>" if i_style else ""}
-        <description><![CDATA[{desc}]]></description>
-        <Point><coordinates>{lon},{lat}</coordinates></Point>
-      </Placemark>"""
+        h = hashlib.blake2b(text.encode("utf-8"), digest_size=16)
+        h.update(self.lon[i:i + 1].tobytes())
+        h.update(self.lat[i:i + 1].tobytes())
+        return h.digest()
 
-        installed_folders.setdefault(node_class, []).append((node_name.lower(), placemark))
+    def assign_ids(self) -> list:
+        """KML ids from the row keys, unique within the store (repeats get ~2, ~3, ...)."""
+        seen = Counter()
+        ids = []
+        for key in self.keys:
+            seen[key] += 1
+            ids.append(f"{self.id_prefix}{key}" if seen[key] == 1 else f"{self.id_prefix}{key}~{seen[key]}")
+        self.ids = ids
+        return ids
 
-    # -----------------------
-    # Build styles
-    # -----------------------
-    style_blocks = []
+    def folder_id(self, group: str) -> str:
+        return f"{self.id_prefix}folder-{group}"
+
+    def spatial_index(self) -> "SpatialIndex":
+        """KD-tree over this store's pins, built on first use (a store is complete once parsed)."""
+        if self._index is None:
+            self._index = SpatialIndex(self)
+        return self._index
 
-    # Prospective category styles
-    for cat, color in PROSPECTIVE_CATEGORY_COLORS.items():
-        sid = style_id("p-cat-", cat)
-        icon_url = PROSPECTIVE_CATEGORY_ICONS.get(cat, PROSPECTIVE_DEFAULT_ICON_URL)
-        style_blocks.append(build_style_block(sid, color, icon_url))
+    def folders(self) -> dict:
+        """group -> record indices, A-Z by name within each group (hidden records left out)."""
+        by_group = [[] for _ in self.groups]
+        hidden = self.hidden
+        for i, code in enumerate(self.group_codes):
+            if i not in hidden:
+                by_group[code].append(i)
+        names = self.names
+        return {
+            self.groups[code]: sorted(idxs, key=lambda i: names[i].lower())
+            for code, idxs in enumerate(by_group) if idxs
+        }
 
-    # Installed status styles
-    for status, color in INSTALLED_STATUS_COLORS.items():
-        sid = style_id("i-status-", status)
-        icon_url = INSTALLED_STATUS_ICONS.get(status, INSTALLED_DEFAULT_ICON_URL)
-        style_blocks.append(build_style_block(sid, color, icon_url))
+# -----------------------
+# Spatial index
+# -----------------------
+# Importable, for scripts and features that need "which nodes are near here" without a scan:
+#
+#     import generate_kml as gk
+#     stores = gk.load_stores()
+#     installed = stores["installed"]
+#     installed.spatial_index().nearest(lon, lat, where=lambda i: installed.group(i) == "Backbone")
+#
+# Pins are projected onto a local equirectangular plane in km, centred on the store's mean
+# latitude; over a region a few hundred km across that is well within 1% of great-circle.
+EARTH_RADIUS_KM = 6371.0088
+KDTREE_LEAF_SIZE = 8
 
-    styles_xml = "\n".join(style_blocks)
+class SpatialIndex:
+    """Static KD-tree over one NodeStore's pins.
 
-    # -----------------------
-    # Build folder XML
-    # -----------------------
-    # Prospective: subfolders by category, stable order you defined, then any extras
-    p_categories = sorted(prospective_folders.keys(), key=lambda c: sort_key_with_preferred_order(c, PROSPECTIVE_CATEGORY_ORDER))
-    p_folder_parts = []
-    for cat in p_categories:
-        entries = prospective_folders[cat]
-        entries.sort(key=lambda x: x[0])  # A-Z by name
-        pms = "".join(pm for _, pm in entries)
-        p_folder_parts.append(f"""
+    Queries take lon/lat and return record indices into the store, paired with distances in
+    km where that makes sense. `where(i)` filters records during the search.
+    """
+
+    def __init__(self, store: NodeStore, lat0: float = None):
+        n = len(store)
+        if lat0 is None:
+            lat0 = sum(store.lat) / n if n else 0.0
+        self.ky = math.radians(EARTH_RADIUS_KM)  # km per degree
+        self.kx = self.ky * math.cos(math.radians(lat0))
+        xs = [lon * self.kx for lon in store.lon]
+        ys = [lat * self.ky for lat in store.lat]
+        # Implicit tree: each range is sorted on its axis and split at the middle slot.
+        order = list(range(n))
+        stack = [(0, n, 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo <= KDTREE_LEAF_SIZE:
+                continue
+            order[lo:hi] = sorted(order[lo:hi], key=(xs if axis == 0 else ys).__getitem__)
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, 1 - axis))
+            stack.append((mid + 1, hi, 1 - axis))
+        self.ids = order  # tree slot -> record index
+        self.xs = [xs[i] for i in order]
+        self.ys = [ys[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def project(self, lon: float, lat: float) -> tuple:
+        return lon * self.kx, lat * self.ky
+
+    def within(self, lon: float, lat: float, radius_km: float, where=None) -> list:
+        """(distance km, record index) for every pin within radius_km, nearest first."""
+        qx, qy = self.project(lon, lat)
+        xs, ys, ids = self.xs, self.ys, self.ids
+        r2 = radius_km * radius_km
+        found = []
+        stack = [(0, len(ids), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo <= KDTREE_LEAF_SIZE:
+                slots = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                d = qx - xs[mid] if axis == 0 else qy - ys[mid]
+                if d <= radius_km:
+                    stack.append((lo, mid, 1 - axis))
+                if d >= -radius_km:
+                    stack.append((mid + 1, hi, 1 - axis))
+                slots = (mid,)
+            for s in slots:
+                dx, dy = xs[s] - qx, ys[s] - qy
+                d2 = dx * dx + dy * dy
+                if d2 <= r2 and (where is None or where(ids[s])):
+                    found.append((math.sqrt(d2), ids[s]))
+        found.sort()
+        return found
+
+    def nearest(self, lon: float, lat: float, k: int = 1, where=None) -> list:
+        """The k closest pins as (distance km, record index), nearest first."""
+        qx, qy = self.project(lon, lat)
+        xs, ys, ids = self.xs, self.ys, self.ids
+        best = []  # max-heap of (-d2, record index)
+
+        def consider(s):
+            dx, dy = xs[s] - qx, ys[s] - qy
+            d2 = dx * dx + dy * dy
+            if (len(best) < k or d2 < -best[0][0]) and (where is None or where(ids[s])):
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, ids[s]))
+                else:
+                    heapq.heapreplace(best, (-d2, ids[s]))
+
+        def visit(lo, hi, axis):
+            if hi - lo <= KDTREE_LEAF_SIZE:
+                for s in range(lo, hi):
+                    consider(s)
+                return
+            mid = (lo + hi) // 2
+            d = qx - xs[mid] if axis == 0 else qy - ys[mid]
+            near, far = ((lo, mid), (mid + 1, hi)) if d <= 0 else ((mid + 1, hi), (lo, mid))
+            visit(*near, 1 - axis)
+            consider(mid)
+            if len(best) < k or d * d < -best[0][0]:
+                visit(*far, 1 - axis)
+
+        if k > 0:
+            visit(0, len(ids), 0)
+        return sorted((math.sqrt(-nd2), i) for nd2, i in best)
+
+    def within_bbox(self, west: float, south: float, east: float, north: float, where=None) -> list:
+        """Record indices of the pins inside a lon/lat box (edges included), ascending."""
+        x0, y0 = self.project(west, south)
+        x1, y1 = self.project(east, north)
+        xs, ys, ids = self.xs, self.ys, self.ids
+        found = []
+        stack = [(0, len(ids), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo <= KDTREE_LEAF_SIZE:
+                slots = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                split, low, high = (xs[mid], x0, x1) if axis == 0 else (ys[mid], y0, y1)
+                if low <= split:
+                    stack.append((lo, mid, 1 - axis))
+                if split <= high:
+                    stack.append((mid + 1, hi, 1 - axis))
+                slots = (mid,)
+            for s in slots:
+                if x0 <= xs[s] <= x1 and y0 <= ys[s] <= y1 and (where is None or where(ids[s])):
+                    found.append(ids[s])
+        found.sort()
+        return found
+
+def load_stores(sources: dict = None) -> dict:
+    """Fetch and parse the sheets without building anything: {"prospective": NodeStore,
+    "installed": NodeStore} (through the HTTP cache), for scripts that query the nodes."""
+    sources = sources or {"prospective": PROSPECTIVE_CSV_URL, "installed": INSTALLED_CSV_URL}
+    parsers = {"prospective": parse_prospective, "installed": parse_installed}
+    stores = {}
+    for name, stream, parsed in fetch_all(sources, parsers):
+        stores[name] = (parsed if parsed is not None else parsers[name](stream))[0]
+    return stores
+
+# -----------------------
+# Placemark cache
+# -----------------------
+class PlacemarkCache:
+    """Rendered placemark fragments from the previous build, keyed by NodeStore.fingerprint().
+
+    The file is tied to config_fingerprint(), so any change to the script or styling starts
+    from empty. Only fragments looked up or added during this build are saved.
+    """
+
+    def __init__(self, path: str, config_hash: str):
+        self.path = path
+        self.config_hash = config_hash
+        self.previous = {}
+        self.current = {}
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path, "rb") as f:
+                data = marshal.load(f)
+            if data.get("config") == config_hash and data.get("python") == sys.version:
+                self.previous = data["fragments"]
+        except (OSError, EOFError, ValueError, TypeError, AttributeError, KeyError):
+            pass
+
+    def get(self, key: bytes):
+        fragment = self.current.get(key)
+        if fragment is None:
+            fragment = self.previous.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self.current[key] = fragment
+        self.hits += 1
+        return fragment
+
+    def start_build(self) -> None:
+        """Reuse this cache for another build in the same process."""
+        if self.current:
+            self.previous, self.current = self.current, {}
+        self.hits = self.misses = 0
+
+    def put(self, key: bytes, fragment: str) -> str:
+        self.current[key] = fragment
+        return fragment
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with atomic_output(self.path, "wb") as f:
+            marshal.dump({"config": self.config_hash, "python": sys.version, "fragments": self.current}, f)
+
+# -----------------------
+# Streaming KML writer
+# -----------------------
+# Everything below writes straight to `out` (any object with .write()), so the document
+# is never assembled as one string. Placemarks are rendered from the NodeStore on the fly.
+def render_placemark(store: NodeStore, i: int, footer: str, style_prefix: str = "", region: str = "") -> str:
+    style_url = store.style_url(i)
+    if style_url:
+        style_url = style_prefix + style_url
+    pid = f' id="{html.escape(store.ids[i])}"' if store.ids else ""
+    return f"""
+      <Placemark{pid}>
+        <name>{html.escape("Mesh: " + store.names[i])}</name>
+        {"<styleUrl>"+html.escape(style_url)+"</styleUrl>" if style_url else ""}
+        <description><![CDATA[{store.description(i, footer)}]]></description>{region}
+        <Point><coordinates>{store.lon[i]},{store.lat[i]}</coordinates></Point>
+      </Placemark>"""
+
+def write_placemark(out, store: NodeStore, i: int, footer: str, style_prefix: str = "", region: str = "", cache=None) -> None:
+    if cache is None:
+        out.write(render_placemark(store, i, footer, style_prefix, region))
+        return
+    key = store.fingerprint(i, footer, style_prefix, region, store.ids[i] if store.ids else "")
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = cache.put(key, render_placemark(store, i, footer, style_prefix, region))
+    out.write(fragment)
+
+def write_clusters(out, clusters: list, family: str, key_order: list, style_prefix: str = "") -> None:
+    out.write("""
       <Folder>
-        <name>{html.escape(cat)}</name>
+        <name>Clusters</name>
         <visibility>1</visibility>
-        <open>0</open>
-        {pms}
+        <open>0</open>""")
+    for level, bounds, lon, lat, counts in clusters:
+        min_lod = 0 if level == 0 else int(CLUSTER_LOD_PIXELS * CLUSTER_LEVELS[level] / CLUSTER_LEVELS[level - 1])
+        total = sum(counts.values())
+        keys = sorted(counts, key=lambda k: sort_key_with_preferred_order(k, key_order))
+        style_url = f"{style_prefix}#{style_id(family, dominant_key(counts, key_order))}"
+        desc = "<br/>".join([f"<b>Sites:</b> {total}"] + [f"<b>{html.escape(k)}:</b> {counts[k]}" for k in keys])
+        out.write(f"""
+        <Placemark>
+          <name>{total}</name>
+          <styleUrl>{html.escape(style_url)}</styleUrl>
+          <description><![CDATA[{desc}]]></description>{region_xml(bounds, min_lod, "          ", CLUSTER_LOD_PIXELS)}
+          <Point><coordinates>{lon:.6f},{lat:.6f}</coordinates></Point>
+        </Placemark>""")
+    out.write("""
       </Folder>""")
-    prospective_xml = f"""
-    <Folder>
-      <name>Prospective Nodes</name>
+
+def pin_region(clustering, idx: int) -> str:
+    if clustering and idx in clustering[1]:
+        return region_xml(clustering[1][idx], CLUSTER_LOD_PIXELS, "        ")
+    return ""
+
+def write_section(out, title: str, folders: dict, store: NodeStore, preferred: list, footer: str, clustering=None, cache=None, style_prefix: str = "") -> None:
+    """One top-level folder with a subfolder per key (preferred order first), entries in the
+    order NodeStore.folders() gave them.
+
+    `clustering` is (clusters, pin_cells, style family, key_order) from cluster_records();
+    clustered pins get a Region so they only draw once their cluster has handed over.
+    `cache` is an optional PlacemarkCache; `style_prefix` points styleUrls at a shared
+    styles document.
+    """
+    section_id = f' id="{html.escape(store.id_prefix)}section"' if store.ids else ""
+    out.write(f"""
+    <Folder{section_id}>
+      <name>{html.escape(title)}</name>
       <visibility>1</visibility>
       <open>0</open>
-      {''.join(p_folder_parts)}
-    </Folder>"""
-
-    # Installed: folders by Node Class (stable preferred order), within each A-Z by Node Name
-    i_classes = sorted(installed_folders.keys(), key=lambda c: sort_key_with_preferred_order(c, NODE_CLASS_ORDER))
-    i_folder_parts = []
-    for cls in i_classes:
-        entries = installed_folders[cls]
-        entries.sort(key=lambda x: x[0])  # A-Z by node name
-        pms = "".join(pm for _, pm in entries)
-        i_folder_parts.append(f"""
-      <Folder>
-        <name>{html.escape(cls)}</name>
+      """)
+    for key in sorted(folders.keys(), key=lambda k: sort_key_with_preferred_order(k, preferred)):
+        entries = folders[key]
+        folder_id = f' id="{html.escape(store.folder_id(key))}"' if store.ids else ""
+        out.write(f"""
+      <Folder{folder_id}>
+        <name>{html.escape(key)}</name>
         <visibility>1</visibility>
         <open>0</open>
-        {pms}
+        """)
+        for idx in entries:
+            write_placemark(out, store, idx, footer, style_prefix, pin_region(clustering, idx), cache)
+        out.write("""
       </Folder>""")
-    installed_xml = f"""
-    <Folder>
-      <name>Installed Nodes</name>
-      <visibility>1</visibility>
-      <open>0</open>
-      {''.join(i_folder_parts)}
-    </Folder>"""
+    if clustering and clustering[0]:
+        clusters, _, family, key_order = clustering
+        write_clusters(out, clusters, family, key_order, style_prefix)
+    out.write("""
+    </Folder>""")
 
-    # -----------------------
-    # Emit sites.kml
-    # -----------------------
-    sites_kml = f"""<?xml version="1.0" encoding="UTF-8"?>
+def write_styles_kml(out, style_blocks: list) -> None:
+    """A Document holding only shared styles, referenced from elsewhere as <file>#id."""
+    out.write("""<?xml version="1.0" encoding="UTF-8"?>
 <kml xmlns="http://www.opengis.net/kml/2.2">
-  <Document>
+  <Document>""")
+    for block in style_blocks:
+        out.write(block)
+    out.write("""
+  </Document>
+</kml>
+""")
+
+def write_sites_kml(out, now: str, style_blocks: list, sections: list, skipped: dict, cache=None, style_prefix: str = "", links=None) -> None:
+    """`links` is an optional (store, links) pair from find_links(), drawn after the sections."""
+    # The Document carries an id once placemarks do, so updates can add styles to it.
+    doc_id = ' id="document"' if any(store.ids for _, _, store, _, _ in sections) else ""
+    out.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document{doc_id}>
     <name>{html.escape(DATASET_NAME)}</name>
     <open>1</open>
     <description><![CDATA[
       Live dataset generated from Google Sheets.<br/>
       Updated (UTC): {now}<br/>
-      Prospective rows skipped: {prospective_skipped}<br/>
-      Installed rows skipped: {installed_skipped}
+      Prospective rows skipped: {format_skipped(skipped["prospective"])}<br/>
+      Installed rows skipped: {format_skipped(skipped["installed"])}
     ]]></description>
-{styles_xml}
-{prospective_xml}
-{installed_xml}
+""")
+    for block in style_blocks:
+        out.write(block)
+        out.write("\n")
+    footer = description_footer()
+    for title, folders, store, preferred, clustering in sections:
+        write_section(out, title, folders, store, preferred, footer, clustering, cache, style_prefix)
+        out.write("\n")
+    if links and links[1]:
+        write_links(out, *links, style_prefix)
+        out.write("\n")
+    out.write("""  </Document>
+</kml>
+""")
+
+# -----------------------
+# GeoJSON writer
+# -----------------------
+def kml_color_to_css(color: str) -> tuple:
+    """KML aabbggrr -> ("#rrggbb", opacity)."""
+    a, b, g, r = color[0:2], color[2:4], color[4:6], color[6:8]
+    return f"#{r}{g}{b}", round(int(a, 16) / 255, 3)
+
+def write_geojson(out, now: str, sections: list, style_defs: list) -> None:
+    """Stream a FeatureCollection with one Point feature per placemark, in sheet order."""
+    styles = {f"#{sid}": (color, icon_url) for sid, color, icon_url in style_defs}
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    out.write('{"type":"FeatureCollection","name":' + dumps(DATASET_NAME) + ',"generated":' + dumps(now) + ',"features":[')
+    sep = "\n"
+    for title, _, store, _, _ in sections:
+        for i in range(len(store)):
+            if i in store.hidden:
+                continue
+            props = {"name": store.names[i], "layer": title, "folder": store.group(i), "style": store.style_key(i)}
+            style = styles.get(store.style_url(i))
+            if style:
+                props["marker-color"], props["marker-opacity"] = kml_color_to_css(style[0])
+                props["icon"] = style[1]
+            for label, (_, kind), value in zip(store.field_names, store.labels, store.values(i)):
+                if value:
+                    props[label] = normalize_date(value) if kind == "date" else value
+            feature = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [store.lon[i], store.lat[i]]},
+                "properties": props,
+            }
+            if store.ids:
+                feature["id"] = store.ids[i]
+            out.write(sep + dumps(feature))
+            sep = ",\n"
+    out.write("\n]}\n")
+
+# -----------------------
+# KMZ packaging
+# -----------------------
+def load_icon(url: str):
+    """Icon bytes for `url`: our own published icons come from LOCAL_ICON_DIR, anything else
+    is downloaded once and kept in the HTTP cache dir. None if it can't be had."""
+    local_base = SITE_BASE_URL + "img/"
+    if url.startswith(local_base):
+        try:
+            with open(os.path.join(LOCAL_ICON_DIR, url[len(local_base):]), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    cache_path = ""
+    if HTTP_CACHE_DIR:
+        cache_path = os.path.join(HTTP_CACHE_DIR, "icons", hashlib.sha256(url.encode("utf-8")).hexdigest())
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                return f.read()
+    try:
+        with urllib.request.urlopen(url, timeout=ICON_FETCH_TIMEOUT) as r:
+            data = r.read()
+    except Exception as e:
+        print(f"WARNING: could not bundle icon {url}: {e}", file=sys.stderr)
+        return None
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            f.write(data)
+    return data
+
+def bundle_icons(icon_urls) -> tuple:
+    """Return ({url: "files/<name>"}, {"files/<name>": bytes}) for every icon we could load."""
+    hrefs, files = {}, {}
+    for url in sorted(set(icon_urls)):
+        data = load_icon(url)
+        if data is None:
+            continue  # keep the remote href
+        base = os.path.basename(url.split("?", 1)[0]) or "icon.png"
+        name = f"files/{base}"
+        if name in files and files[name] != data:
+            name = f"files/{hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]}-{base}"
+        hrefs[url] = name
+        files[name] = data
+    return hrefs, files
+
+def write_kmz(path: str, write_doc, files: dict) -> None:
+    """Zip doc.kml (streamed by `write_doc(out)`) plus bundled files into `path`."""
+    with atomic_output(path, "wb") as raw, zipfile.ZipFile(raw, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+        # doc.kml goes first; Google Earth opens the first .kml entry in the archive.
+        with io.TextIOWrapper(zf.open("doc.kml", "w", force_zip64=True), encoding="utf-8") as out:
+            write_doc(out)
+        for name, data in files.items():
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))  # fixed stamp keeps the archive reproducible
+            zf.writestr(info, data, compress_type=zipfile.ZIP_STORED)  # PNGs are already compressed
+
+# -----------------------
+# Region/LOD tiled output
+# -----------------------
+def grid_sample(items: list, bounds: tuple, limit: int) -> tuple:
+    """Split items into (kept, rest) with at most `limit` kept, one per cell of a grid over
+    `bounds` first, so a coarse tile shows an even scatter instead of whichever rows came first."""
+    if len(items) <= limit:
+        return items, []
+    west, south, east, north = bounds
+    g = max(1, int(limit ** 0.5))
+    cell_w = (east - west) / g or 1.0
+    cell_h = (north - south) / g or 1.0
+    seen = set()
+    kept, rest = [], []
+    for item in items:
+        cell = (min(g - 1, int((item[0] - west) / cell_w)), min(g - 1, int((item[1] - south) / cell_h)))
+        if cell in seen or len(kept) >= limit:
+            rest.append(item)
+        else:
+            seen.add(cell)
+            kept.append(item)
+    fill = limit - len(kept)
+    if fill > 0:
+        kept.extend(rest[:fill])
+        rest = rest[fill:]
+    return kept, rest
+
+def build_quadtree(items: list, bounds: tuple, key: str = "t", depth: int = 0):
+    """Yield (key, bounds, kept_items, children) per tile; children are (key, bounds) pairs.
+    Items are (lon, lat, section_index, record_index)."""
+    if depth < TILE_MAX_DEPTH:
+        kept, rest = grid_sample(items, bounds, TILE_MAX_PLACEMARKS)
+    else:
+        kept, rest = items, []
+    children = []
+    if rest:
+        west, south, east, north = bounds
+        mid_lon, mid_lat = (west + east) / 2, (south + north) / 2
+        quads = [
+            (west, mid_lat, mid_lon, north), (mid_lon, mid_lat, east, north),
+            (west, south, mid_lon, mid_lat), (mid_lon, south, east, mid_lat),
+        ]
+        buckets = [[], [], [], []]
+        for item in rest:
+            buckets[(0 if item[1] >= mid_lat else 2) + (1 if item[0] >= mid_lon else 0)].append(item)
+        for i, bucket in enumerate(buckets):
+            if bucket:
+                children.append((f"{key}{i}", quads[i]))
+                yield from build_quadtree(bucket, quads[i], f"{key}{i}", depth + 1)
+    yield key, bounds, kept, children
+
+def region_xml(bounds: tuple, min_lod_pixels: int, indent: str, max_lod_pixels: int = -1) -> str:
+    west, south, east, north = bounds
+    return f"""
+{indent}<Region>
+{indent}  <LatLonAltBox><north>{north}</north><south>{south}</south><east>{east}</east><west>{west}</west></LatLonAltBox>
+{indent}  <Lod><minLodPixels>{min_lod_pixels}</minLodPixels><maxLodPixels>{max_lod_pixels}</maxLodPixels></Lod>
+{indent}</Region>"""
+
+def tile_link_xml(key: str, bounds: tuple, min_lod_pixels: int) -> str:
+    return f"""
+    <NetworkLink>
+      <name>{key}</name>{region_xml(bounds, min_lod_pixels, "      ")}
+      <Link><href>{key}.kml</href><viewRefreshMode>onRegion</viewRefreshMode></Link>
+    </NetworkLink>"""
+
+# -----------------------
+# NetworkLinkControl updates
+# -----------------------
+def placemark_snapshot(sections: list, footer: str, style_ids: list = ()) -> dict:
+    """{"placemarks": {id: [fingerprint, folder id, geometry hash]},
+    "folders": {folder id: [section id, name]}, "styles": [style id]} for stores that have
+    ids assigned; `style_ids` are the shared styles sites.kml defines."""
+    placemarks, folders = {}, {}
+    for _, groups, store, _, clustering in sections:
+        if not store.ids:
+            continue
+        for group, idxs in groups.items():
+            fid = store.folder_id(group)
+            folders[fid] = [f"{store.id_prefix}section", group]
+            for i in idxs:
+                region = pin_region(clustering, i)
+                fp = store.fingerprint(i, footer, region, store.ids[i]).hex()
+                geometry = hashlib.blake2b(f"{store.lon[i]},{store.lat[i]}{region}".encode("utf-8"), digest_size=8).hexdigest()
+                placemarks[store.ids[i]] = [fp, fid, geometry]
+    return {"placemarks": placemarks, "folders": folders, "styles": list(style_ids)}
+
+def load_snapshot(config_hash: str) -> dict:
+    try:
+        with open(UPDATE_SNAPSHOT, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if data.get("config") == config_hash else {}
+
+def write_snapshot(snapshot: dict, config_hash: str) -> None:
+    os.makedirs(os.path.dirname(UPDATE_SNAPSHOT) or ".", exist_ok=True)
+    with atomic_output(UPDATE_SNAPSHOT) as f:
+        json.dump({"config": config_hash, **snapshot}, f, separators=(",", ":"))
+
+def render_placemark_change(store: NodeStore, i: int, footer: str, style_prefix: str = "") -> str:
+    # <Change> only replaces simple fields; moved pins are deleted and re-created instead.
+    style_url = store.style_url(i)
+    if style_url:
+        style_url = style_prefix + style_url
+    return f"""
+      <Placemark targetId="{html.escape(store.ids[i])}">
+        <name>{html.escape("Mesh: " + store.names[i])}</name>
+        {"<styleUrl>"+html.escape(style_url)+"</styleUrl>" if style_url else ""}
+        <description><![CDATA[{store.description(i, footer)}]]></description>
+      </Placemark>"""
+
+def write_update_kml(out, target_href: str, sections: list, footer: str, previous: dict, current: dict,
+                     style_prefix: str = "", style_blocks: dict = None) -> dict:
+    """Write the <Update> that turns the previous build into the current one; returns op counts.
+
+    With no usable previous snapshot the Update is empty and clients rely on the full reload.
+    `style_blocks` ({style id: XML}) are the inline styles; any the previous sites.kml didn't
+    define are created in its Document ahead of the placemarks that use them.
+    """
+    counts = {"create": 0, "change": 0, "delete": 0}
+    out.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <NetworkLinkControl>
+    <Update>
+      <targetHref>{html.escape(target_href)}</targetHref>""")
+    if previous:
+        old, new = previous["placemarks"], current["placemarks"]
+        old_folders, new_folders = previous["folders"], current["folders"]
+        by_id = {store.ids[i]: (store, i, clustering)
+                 for _, groups, store, _, clustering in sections if store.ids
+                 for idxs in groups.values() for i in idxs}
+        new_styles = [sid for sid in current["styles"] if sid not in set(previous.get("styles", ()))]
+        if style_blocks and new_styles:
+            # <Delete> only takes Features, so unlike placemarks these can't be cleared first: a
+            # replayed update adds another identical copy of each style, which is harmless.
+            out.write("""
+      <Create>
+        <Document targetId="document">""")
+            for sid in new_styles:
+                out.write(style_blocks[sid])
+            out.write("""
+        </Document>
+      </Create>""")
+        created = {}  # folder id -> [placemark ids]; moved placemarks are re-created too
+        changed = []
+        for pid, (fp, fid, geometry) in new.items():
+            before = old.get(pid)
+            if before is None or before[1:] != [fid, geometry]:
+                created.setdefault(fid, []).append(pid)
+            elif before[0] != fp:
+                changed.append(pid)
+        gone = [pid for pid in old if pid not in new]
+        recreated = [pid for pids in created.values() for pid in pids]
+        # New folders are deleted first too, so a replayed update doesn't add them twice; every
+        # placemark in one is in `created`, so it's re-created below.
+        new_fids = [fid for fid in created if fid not in old_folders]
+
+        if gone or recreated:
+            out.write("""
+      <Delete>""")
+            for pid in gone + recreated:
+                out.write(f"""
+        <Placemark targetId="{html.escape(pid)}"/>""")
+            for fid in new_fids:
+                out.write(f"""
+        <Folder targetId="{html.escape(fid)}"/>""")
+            out.write("""
+      </Delete>""")
+            counts["delete"] = len(gone)
+        for fid in new_fids:
+            section_id, name = new_folders[fid]
+            out.write(f"""
+      <Create>
+        <Folder targetId="{html.escape(section_id)}">
+          <Folder id="{html.escape(fid)}">
+            <name>{html.escape(name)}</name>
+            <visibility>1</visibility>
+            <open>0</open>
+          </Folder>
+        </Folder>
+      </Create>""")
+        for fid, pids in created.items():
+            out.write(f"""
+      <Create>
+        <Folder targetId="{html.escape(fid)}">""")
+            for pid in pids:
+                store, i, clustering = by_id[pid]
+                out.write(render_placemark(store, i, footer, style_prefix, pin_region(clustering, i)))
+            out.write("""
+        </Folder>
+      </Create>""")
+            counts["create"] += len(pids)
+        if changed:
+            out.write("""
+      <Change>""")
+            for pid in changed:
+                store, i, _ = by_id[pid]
+                out.write(render_placemark_change(store, i, footer, style_prefix))
+            out.write("""
+      </Change>""")
+            counts["change"] = len(changed)
+        emptied = [fid for fid in old_folders if fid not in new_folders]
+        if emptied:
+            out.write("""
+      <Delete>""")
+            for fid in emptied:
+                out.write(f"""
+        <Folder targetId="{html.escape(fid)}"/>""")
+            out.write("""
+      </Delete>""")
+    out.write("""
+    </Update>
+  </NetworkLinkControl>
+</kml>
+""")
+    return counts
+
+def live_networklink_kml(sites_href: str, update_href: str) -> str:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>{html.escape(NETWORKLINK_NAME)}</name>
+    <open>1</open>
+    <NetworkLink>
+      <name>{html.escape(DATASET_NAME)}</name>
+      <Link>
+        <href>{html.escape(sites_href)}</href>
+        <refreshMode>onInterval</refreshMode>
+        <refreshInterval>{FULL_REFRESH_SECONDS}</refreshInterval>
+      </Link>
+    </NetworkLink>
+    <NetworkLink>
+      <name>Updates</name>
+      <Link>
+        <href>{html.escape(update_href)}</href>
+        <refreshMode>onInterval</refreshMode>
+        <refreshInterval>{REFRESH_SECONDS}</refreshInterval>
+      </Link>
+    </NetworkLink>
   </Document>
 </kml>
 """
-    with open(OUTPUT_KML, "w", encoding="utf-8") as f:
-        f.write(sites_kml)
+
+# -----------------------
+# Clustering
+# -----------------------
+def cluster_records(store: NodeStore, levels: list, min_points: int) -> tuple:
+    """Grid-cluster a store's nodes at each level (a spatial hash per level, so O(n * levels)).
+
+    Returns (clusters, pin_cells): clusters are (level, bounds, lon, lat, {style_key: count}),
+    pin_cells maps record index -> bounds of the finest cell that clustered it.
+    """
+    clusters, pin_cells = [], {}
+    for level, size in enumerate(levels):
+        cells = {}
+        for idx, (lon, lat) in enumerate(zip(store.lon, store.lat)):
+            if idx in store.hidden:
+                continue
+            cells.setdefault((math.floor(lon / size), math.floor(lat / size)), []).append(idx)
+        for (cx, cy), members in sorted(cells.items()):
+            if len(members) < min_points:
+                continue
+            bounds = tuple(round(v * size, 9) for v in (cx, cy, cx + 1, cy + 1))
+            counts = {}
+            for idx in members:
+                key = store.style_key(idx)
+                counts[key] = counts.get(key, 0) + 1
+                pin_cells[idx] = bounds  # finer levels overwrite coarser ones
+            lon = sum(store.lon[idx] for idx in members) / len(members)
+            lat = sum(store.lat[idx] for idx in members) / len(members)
+            clusters.append((level, bounds, lon, lat, counts))
+    return clusters, pin_cells
+
+def write_tiles(tiles_dir: str, now: str, style_blocks: list, sections: list, skipped: dict) -> None:
+    """Write TILES_DIR/{root,styles,t*}.kml. Tiles share styles via styles.kml#id."""
+    # Installed nodes go first so they're the ones kept at coarse levels.
+    items = [
+        (lon, lat, s, idx)
+        for s in reversed(range(len(sections)))
+        for idx, (lon, lat) in enumerate(zip(sections[s][2].lon, sections[s][2].lat))
+        if idx not in sections[s][2].hidden
+    ]
+    os.makedirs(tiles_dir, exist_ok=True)
+    written = {"root.kml", "styles.kml"}
+    footer = description_footer()
+
+    with atomic_output(os.path.join(tiles_dir, "styles.kml")) as f:
+        write_styles_kml(f, style_blocks)
+
+    root_link = ""
+    if items:
+        west, east = min(i[0] for i in items), max(i[0] for i in items)
+        south, north = min(i[1] for i in items), max(i[1] for i in items)
+        pad = 0.001
+        bounds = (west - pad, south - pad, east + pad, north + pad)
+        root_link = tile_link_xml("t", bounds, 0)
+        for key, tile_bounds, kept, children in build_quadtree(items, bounds):
+            min_lod = 0 if key == "t" else TILE_MIN_LOD_PIXELS
+            written.add(f"{key}.kml")
+            with atomic_output(os.path.join(tiles_dir, f"{key}.kml"), buffering=1 << 16) as f:
+                f.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>{key}</name>{region_xml(tile_bounds, min_lod, "    ")}""")
+                for s, (title, _, store, _, _) in enumerate(sections):
+                    idxs = sorted((idx for _, _, sec, idx in kept if sec == s), key=lambda i: store.names[i].lower())
+                    if not idxs:
+                        continue
+                    f.write(f"""
+    <Folder>
+      <name>{html.escape(title)}</name>""")
+                    for idx in idxs:
+                        write_placemark(f, store, idx, footer, style_prefix="styles.kml")
+                    f.write("""
+    </Folder>""")
+                for child_key, child_bounds in children:
+                    f.write(tile_link_xml(child_key, child_bounds, TILE_MIN_LOD_PIXELS))
+                f.write("""
+  </Document>
+</kml>
+""")
+
+    with atomic_output(os.path.join(tiles_dir, "root.kml")) as f:
+        f.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>{html.escape(DATASET_NAME)}</name>
+    <open>1</open>
+    <description><![CDATA[
+      Live dataset generated from Google Sheets (tiled).<br/>
+      Updated (UTC): {now}<br/>
+      Prospective rows skipped: {format_skipped(skipped["prospective"])}<br/>
+      Installed rows skipped: {format_skipped(skipped["installed"])}
+    ]]></description>{root_link}
+  </Document>
+</kml>
+""")
+
+    # Drop tiles left over from a previous, differently shaped tree.
+    for fname in os.listdir(tiles_dir):
+        if fname.endswith(".kml") and fname not in written:
+            os.remove(os.path.join(tiles_dir, fname))
+
+def read_header(reader, required: list, sheet: str) -> dict:
+    cols = column_index(next(reader, []))
+    missing = [c for c in required if c not in cols]
+    if missing:
+        die(f"{sheet} sheet missing required columns: {missing}. Found: {sorted(cols)}")
+    return cols
+
+def iter_batches(reader, size: int):
+    """(row numbers, rows) for the non-blank data rows of a csv.reader, up to `size` at a time.
+
+    Numbers count records, not physical lines, so they match the spreadsheet even when a
+    cell holds line breaks (the header is row 1).
+    """
+    numbers, batch = [], []
+    for number, row in enumerate(reader, start=2):
+        if not row:
+            continue  # blank line
+        numbers.append(number)
+        batch.append(row)
+        if len(batch) >= size:
+            yield numbers, batch
+            numbers, batch = [], []
+    if batch:
+        yield numbers, batch
+
+def missing_column(row: list, required: list):
+    """("missing", column) for the first empty cell among `required` [(index, column)], else None."""
+    for i, column in required:
+        if not cell(row, i):
+            return ("missing", column)
+    return None
+
+def reject_counts(rejects: list) -> Counter:
+    """(code, column) -> rows dropped, from a parser's reject list."""
+    return Counter((code, column) for _, column, code, _ in rejects)
+
+def format_skipped(rejects: list) -> str:
+    """"3 (missing Name: 1, unparseable Latitude: 2)", or "0" when nothing was dropped."""
+    if not rejects:
+        return "0"
+    detail = ", ".join(f"{code.replace('_', ' ')} {column}: {n}" for (code, column), n in sorted(reject_counts(rejects).items()))
+    return f"{len(rejects)} ({detail})"
+
+REJECT_COLUMNS = ["sheet", "row", "column", "reason", "value"]
+
+def write_rejects(rejects_by_sheet: dict, csv_path: str, json_path: str) -> None:
+    records = [
+        dict(zip(REJECT_COLUMNS, (sheet, number, column, code, value)))
+        for sheet, rejects in rejects_by_sheet.items()
+        for number, column, code, value in rejects
+    ]
+    if csv_path:
+        with atomic_output(csv_path, newline="") as f:
+            w = csv.DictWriter(f, fieldnames=REJECT_COLUMNS)
+            w.writeheader()
+            w.writerows(records)
+    if json_path:
+        with atomic_output(json_path) as f:
+            json.dump(records, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+
+# -----------------------
+# Coordinate validation
+# -----------------------
+# Each batch is checked as two whole columns: one map(float) into an array('d') when a
+# column is plain decimals, the slow DMS/comma-decimal parser only when it isn't. Results
+# come back as parallel arrays plus a per-row reason list (None = accepted).
+# Unit letters (d/deg, m, s) only count when they touch the number, so "32 45 30 S" is south.
+COORD_RE = re.compile(r"""
+    ^(?P<h1>[NSEW])?\s*
+    (?P<deg>[-+]?\d+(?:\.\d+)?)(?:deg|d|\s*(?:°|º|:))?\s*
+    (?:(?P<min>\d+(?:\.\d+)?)(?:m|\s*(?:'|′|:))?\s*)?
+    (?:(?P<sec>\d+(?:\.\d+)?)(?:s|\s*(?:"|″|''))?\s*)?
+    (?P<h2>[NSEW])?$""", re.IGNORECASE | re.VERBOSE)
+
+def parse_coordinate(text: str) -> tuple:
+    """(degrees, hemisphere letter or "") from a decimal, comma-decimal or DMS cell; degrees is None if unparseable.
+
+    >>> parse_coordinate("32 45 30 S")
+    (-32.75833333333333, 'S')
+    >>> parse_coordinate("32d45m30s S")
+    (-32.75833333333333, 'S')
+    """
+    text = text.strip()
+    try:
+        return float(text), ""
+    except ValueError:
+        pass
+    if text.count(",") == 1 and "." not in text:
+        try:
+            return float(text.replace(",", ".")), ""
+        except ValueError:
+            pass
+    m = COORD_RE.match(text)
+    if not m or (m["h1"] and m["h2"]):
+        return None, ""
+    minutes, seconds = float(m["min"] or 0), float(m["sec"] or 0)
+    if minutes >= 60 or seconds >= 60 or (m["sec"] and not m["min"]):
+        return None, ""
+    hemisphere = (m["h1"] or m["h2"] or "").upper()
+    degrees = abs(float(m["deg"])) + minutes / 60 + seconds / 3600
+    if m["deg"].startswith("-") or hemisphere in ("S", "W"):
+        degrees = -degrees
+    return degrees, hemisphere
+
+def coordinate_column(values: list) -> tuple:
+    """(array('d') of degrees with NaN for unparseable cells, hemisphere letters or None)."""
+    try:
+        return array("d", map(float, values)), None
+    except ValueError:
+        pass
+    degrees = array("d", bytes(8 * len(values)))
+    hemispheres = [""] * len(values)
+    for k, value in enumerate(values):
+        d, hemispheres[k] = parse_coordinate(value)
+        degrees[k] = math.nan if d is None else d
+    return degrees, hemispheres
+
+def in_bbox(lat: float, lon: float) -> bool:
+    west, south, east, north = COORD_BBOX
+    return south <= lat <= north and west <= lon <= east
+
+def validate_coordinates(lat_values: list, lon_values: list) -> tuple:
+    """Validate one batch of Latitude/Longitude cells.
+
+    Returns (lats, lons, reasons, swapped): reasons[k] is None for an accepted row or a
+    (code, column) pair saying why it was dropped; swapped counts rows flipped back.
+    """
+    lats, lat_hemis = coordinate_column(lat_values)
+    lons, lon_hemis = coordinate_column(lon_values)
+    hinted = lat_hemis is not None or lon_hemis is not None
+    reasons = [None] * len(lats)
+    swapped = 0
+    for k in range(len(lats)):
+        lat, lon = lats[k], lons[k]
+        if -90 <= lat <= 90 and -180 <= lon <= 180 and not hinted and not COORD_BBOX:
+            continue  # plain in-range decimals; nothing else to check
+        if math.isnan(lat) or math.isinf(lat):
+            reasons[k] = ("missing" if not lat_values[k].strip() else "unparseable", "Latitude")
+            continue
+        if math.isnan(lon) or math.isinf(lon):
+            reasons[k] = ("missing" if not lon_values[k].strip() else "unparseable", "Longitude")
+            continue
+        lat_h = lat_hemis[k] if lat_hemis else ""
+        lon_h = lon_hemis[k] if lon_hemis else ""
+        if lat_h and lon_h and (lat_h in "NS") == (lon_h in "NS"):
+            reasons[k] = ("conflicting_hemispheres", "Latitude")
+            continue
+        if (
+            lat_h in ("E", "W") or lon_h in ("N", "S")
+            or (abs(lat) > 90 and abs(lon) <= 90)
+            or (COORD_BBOX and not in_bbox(lat, lon) and in_bbox(lon, lat))
+        ):
+            lat, lon = lats[k], lons[k] = lon, lat
+            swapped += 1
+        if not -90 <= lat <= 90:
+            reasons[k] = ("out_of_range", "Latitude")
+        elif not -180 <= lon <= 180:
+            reasons[k] = ("out_of_range", "Longitude")
+    return lats, lons, reasons, swapped
+
+# -----------------------
+# Read Prospective sheet
+# -----------------------
+def parse_prospective(p_lines) -> tuple:
+    p_reader = csv.reader(p_lines)
+    p_cols = read_header(p_reader, PROSPECTIVE_REQUIRED_COLUMNS, "Prospective")
+    i_name, i_cat, i_lat, i_lon = (p_cols[c] for c in ("Name", "Category", "Latitude", "Longitude"))
+    required = [(i_name, "Name"), (i_cat, "Category")]
+
+    # Styles are category-based for Prospective; folders are by category too.
+    store = NodeStore(compile_fields(PROSPECTIVE_FIELDS, p_cols), "p-cat-", id_prefix="p-")
+    prospective_rejects = []  # (row number, column, reason code, value)
+
+    for numbers, batch in iter_batches(p_reader, VALIDATE_BATCH_ROWS):
+        lats, lons, reasons, swapped = validate_coordinates(
+            [cell(row, i_lat) for row in batch], [cell(row, i_lon) for row in batch]
+        )
+        store.swapped += swapped
+        for number, row, lat, lon, reason in zip(numbers, batch, lats, lons, reasons):
+            reason = missing_column(row, required) or reason
+            if reason:
+                code, column = reason
+                prospective_rejects.append((number, column, code, cell(row, p_cols[column])))
+                continue
+            category = cell(row, i_cat)
+            store.append(row, cell(row, i_name), lon, lat, category, category)
+
+    return store, prospective_rejects
+
+# -----------------------
+# Read Installed sheet
+# -----------------------
+def parse_installed(i_lines) -> tuple:
+    i_reader = csv.reader(i_lines)
+    i_cols = read_header(i_reader, INSTALLED_REQUIRED_COLUMNS, "Installed")
+    i_id, i_name, i_class, i_status, i_lat, i_lon = (
+        i_cols[c] for c in ("Node ID", "Node Name", "Node Class", "Node Status", "Latitude", "Longitude")
+    )
+    required = [(i_id, "Node ID"), (i_name, "Node Name"), (i_class, "Node Class"), (i_status, "Node Status")]
+
+    # Installed styles are status-based; folders are by Node Class.
+    store = NodeStore(compile_fields(INSTALLED_FIELDS, i_cols), "i-status-", id_prefix="i-")
+    installed_rejects = []  # (row number, column, reason code, value)
+
+    for numbers, batch in iter_batches(i_reader, VALIDATE_BATCH_ROWS):
+        lats, lons, reasons, swapped = validate_coordinates(
+            [cell(row, i_lat) for row in batch], [cell(row, i_lon) for row in batch]
+        )
+        store.swapped += swapped
+        for number, row, lat, lon, reason in zip(numbers, batch, lats, lons, reasons):
+            reason = missing_column(row, required) or reason
+            if reason:
+                code, column = reason
+                installed_rejects.append((number, column, code, cell(row, i_cols[column])))
+                continue
+            store.append(row, cell(row, i_name), lon, lat, cell(row, i_class), cell(row, i_status), cell(row, i_id))
+
+    return store, installed_rejects
+
+# -----------------------
+# Duplicate detection
+# -----------------------
+DUPLICATE_COLUMNS = [
+    "kept_sheet", "kept_key", "kept_name", "duplicate_sheet", "duplicate_key", "duplicate_name",
+    "reason", "distance_m", "name_similarity",
+]
+
+def normalize_name(name: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+def name_similarity(a: str, b: str) -> float:
+    return 1.0 if a == b else difflib.SequenceMatcher(None, a, b).ratio()
+
+def find_duplicates(stores: dict, radius_m: float, min_similarity: float) -> list:
+    """Pairs of rows that look like the same site, as (kept, duplicate, reason, distance m,
+    name similarity) with kept/duplicate = (sheet, record index).
+
+    `stores` is {"installed": NodeStore, "prospective": NodeStore}. Nearby candidates come
+    from a spatial hash with radius-sized cells (each cell is compared with itself and four
+    of its neighbours, so every adjacent pair of cells is seen once); links come from the
+    prospective "Installed Node Name" column. Both are near-linear in the number of rows.
+    """
+    rank = {sheet: r for r, sheet in enumerate(("installed", "prospective"))}
+    lats = [lat for store in stores.values() for lat in store.lat]
+    ky = math.radians(EARTH_RADIUS_KM) * 1000  # m per degree
+    kx = ky * math.cos(math.radians(sum(lats) / len(lats))) if lats else ky
+    xy = {sheet: (store.lon, store.lat) for sheet, store in stores.items()}
+    names = {}
+
+    def norm(ref):
+        if ref not in names:
+            names[ref] = normalize_name(stores[ref[0]].names[ref[1]])
+        return names[ref]
+
+    def distance(a, b):
+        (alon, alat), (blon, blat) = xy[a[0]], xy[b[0]]
+        return math.hypot((alon[a[1]] - blon[b[1]]) * kx, (alat[a[1]] - blat[b[1]]) * ky)
+
+    def ordered(a, b):
+        return (a, b) if (rank[a[0]], a[1]) < (rank[b[0]], b[1]) else (b, a)
+
+    pairs = {}
+
+    # Installed Node Name links (any distance; only if the prospective sheet has the column)
+    by_name = {}
+    linked_names = []
+    if "Installed Node Name" in stores["prospective"].field_names:
+        linked_names = stores["prospective"].column("Installed Node Name")
+        for j, name in enumerate(stores["installed"].names):
+            by_name.setdefault(normalize_name(name), j)
+    for i, linked in enumerate(linked_names):
+        j = by_name.get(normalize_name(linked)) if linked else None
+        if j is not None:
+            a, b = ("installed", j), ("prospective", i)
+            pairs[a, b] = ("linked", distance(a, b), name_similarity(norm(a), norm(b)))
+
+    # Nearby pins with similar names
+    cells = {}
+    for sheet, (lons, lats) in xy.items():
+        for i, (lon, lat) in enumerate(zip(lons, lats)):
+            cells.setdefault((math.floor(lon * kx / radius_m), math.floor(lat * ky / radius_m)), []).append((sheet, i))
+    for (cx, cy), members in cells.items():
+        for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            others = cells.get((cx + dx, cy + dy))
+            if not others:
+                continue
+            for n, a in enumerate(members):
+                for b in (members[n + 1:] if others is members else others):
+                    key = ordered(a, b)
+                    if key in pairs:
+                        continue
+                    d = distance(a, b)
+                    if d > radius_m:
+                        continue
+                    similarity = name_similarity(norm(a), norm(b))
+                    if similarity >= min_similarity:
+                        pairs[key] = ("nearby", d, similarity)
+
+    return sorted(
+        (kept, dup, reason, d, similarity) for (kept, dup), (reason, d, similarity) in pairs.items()
+    )
+
+def apply_duplicates(stores: dict, pairs: list, action: str) -> int:
+    """Annotate or fold matched rows (chains resolve to one kept row); returns rows folded."""
+    rank = {sheet: r for r, sheet in enumerate(("installed", "prospective"))}
+    parent = {}
+
+    def root(ref):
+        while parent.get(ref, ref) != ref:
+            ref = parent[ref]
+        return ref
+
+    for kept, dup, *_ in pairs:
+        a, b = root(kept), root(dup)
+        if a != b:
+            a, b = sorted((a, b), key=lambda ref: (rank[ref[0]], ref[1]))
+            parent[b] = a
+
+    titles = {"installed": "Installed", "prospective": "Prospective"}
+    also = {}
+    for store in stores.values():
+        store.notes, store.hidden = {}, set()
+    for dup in sorted(parent):
+        kept = root(dup)
+        kept_store, dup_store = stores[kept[0]], stores[dup[0]]
+        also.setdefault(kept, []).append(f"{html.escape(dup_store.names[dup[1]])} ({titles[dup[0]]})")
+        if action == "fold":
+            dup_store.hidden.add(dup[1])
+        else:
+            dup_store.notes[dup[1]] = (
+                f"<b>Possible duplicate of:</b> {html.escape(kept_store.names[kept[1]])} ({titles[kept[0]]})"
+            )
+    for (sheet, i), listed in also.items():
+        label = "Also listed as" if action == "fold" else "Possible duplicates"
+        stores[sheet].notes[i] = f"<b>{label}:</b> " + "; ".join(listed)
+    return len(parent) if action == "fold" else 0
+
+def write_duplicates(stores: dict, pairs: list, path: str) -> None:
+    with atomic_output(path, newline="") as f:
+        w = csv.writer(f)
+        w.writerow(DUPLICATE_COLUMNS)
+        for kept, dup, reason, d, similarity in pairs:
+            row = []
+            for sheet, i in (kept, dup):
+                row += [sheet, stores[sheet].keys[i], stores[sheet].names[i]]
+            w.writerow(row + [reason, round(d, 1), round(similarity, 3)])
+
+# -----------------------
+# Link budget
+# -----------------------
+def antenna_gain_dbi(text: str) -> float:
+    """'5.8', '8 dBi', '6 dBd' -> dBi; blank or unreadable -> LINK_DEFAULT_GAIN_DBI."""
+    m = re.search(r"[-+]?\d+(?:\.\d+)?", text)
+    if not m:
+        return LINK_DEFAULT_GAIN_DBI
+    gain = float(m.group())
+    return gain + 2.15 if "dbd" in text.lower() else gain
+
+def free_space_path_loss_db(distance_km: float, frequency_mhz: float) -> float:
+    return 20 * math.log10(distance_km) + 20 * math.log10(frequency_mhz) + 32.44
+
+def link_tier(margin: float):
+    """The LINK_QUALITY entry a margin falls in, or None below the last tier."""
+    return next((tier for tier in LINK_QUALITY if margin >= tier[0]), None)
+
+def find_links(store: NodeStore, max_km: float) -> list:
+    """Candidate links between installed nodes, strongest first, as (margin dB, i, j,
+    distance km, path loss dB, received dBm) with i < j.
+
+    One radius query per node on the store's spatial index, so O(n log n + links) rather
+    than all pairs; distances are the index's projected km.
+    """
+    excluded = {status.lower() for status in LINK_EXCLUDE_STATUSES}
+    eligible = [
+        i not in store.hidden and status.lower() not in excluded
+        for i, status in enumerate(store.column("Node Status"))
+    ]
+    gains = [antenna_gain_dbi(text) for text in store.column("Antenna Gain")]
+    index = store.spatial_index()
+    links = []
+    for i in range(len(store)):
+        if not eligible[i]:
+            continue
+        for d, j in index.within(store.lon[i], store.lat[i], max_km, where=lambda j: j > i and eligible[j]):
+            loss = free_space_path_loss_db(max(d, 0.001), LINK_FREQUENCY_MHZ)
+            rx = LINK_TX_POWER_DBM + gains[i] + gains[j] - loss - LINK_EXTRA_LOSS_DB
+            margin = rx - LINK_RX_SENSITIVITY_DBM
+            if link_tier(margin):
+                links.append((margin, i, j, d, loss, rx))
+    links.sort(key=lambda link: (-link[0], link[1], link[2]))
+    return links
+
+def build_link_style_blocks(links: list) -> list:
+    """LineStyles for the LINK_QUALITY tiers that `links` uses."""
+    used = {link_tier(link[0])[1] for link in links}
+    return [f"""
+    <Style id="{html.escape(style_id('link-', tier))}">
+      <LineStyle>
+        <color>{color}</color>
+        <width>{width}</width>
+      </LineStyle>
+    </Style>""" for _, tier, color, width in LINK_QUALITY if tier in used]
+
+def write_links(out, store: NodeStore, links: list, style_prefix: str = "") -> None:
+    """A "Links" folder with a subfolder per quality tier and a LineString per link."""
+    by_tier = {}
+    for link in links:
+        by_tier.setdefault(link_tier(link[0])[1], []).append(link)
+    out.write("""
+    <Folder>
+      <name>Links</name>
+      <visibility>1</visibility>
+      <open>0</open>""")
+    for _, tier, _, _ in LINK_QUALITY:
+        if tier not in by_tier:
+            continue
+        style_url = f"{style_prefix}#{style_id('link-', tier)}"
+        out.write(f"""
+      <Folder>
+        <name>{html.escape(tier)}</name>
+        <visibility>1</visibility>
+        <open>0</open>""")
+        for margin, i, j, d, loss, rx in by_tier[tier]:
+            desc = "<br/>".join([
+                f"<b>Distance:</b> {d:.2f} km",
+                f"<b>Free-space path loss:</b> {loss:.1f} dB",
+                f"<b>Received:</b> {rx:.1f} dBm",
+                f"<b>Margin:</b> {margin:.1f} dB",
+            ])
+            out.write(f"""
+        <Placemark>
+          <name>{html.escape(f"{store.names[i]} - {store.names[j]}")}</name>
+          <styleUrl>{html.escape(style_url)}</styleUrl>
+          <description><![CDATA[{desc}]]></description>
+          <LineString>
+            <tessellate>1</tessellate>
+            <coordinates>{store.lon[i]},{store.lat[i]} {store.lon[j]},{store.lat[j]}</coordinates>
+          </LineString>
+        </Placemark>""")
+        out.write("""
+      </Folder>""")
+    out.write("""
+    </Folder>""")
+
+# -----------------------
+# Build metrics
+# -----------------------
+class BuildMetrics:
+    """Monotonic per-stage timers (plus tracemalloc peaks when enabled) and build counters."""
+
+    def __init__(self, trace_memory: bool = METRICS_TRACEMALLOC):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.counters = {}
+        self.result = ""
+        self._t0 = time.monotonic()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            entry = {"seconds": round(time.monotonic() - t0, 6)}
+            if self.trace_memory:
+                entry["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.stages[name] = entry
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        return {
+            "result": self.result,
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "total_seconds": round(time.monotonic() - self._t0, 6),
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+
+    def as_prometheus(self) -> str:
+        data = self.as_dict()
+        lines = [
+            "# HELP meshnodes_build_stage_seconds Wall time of each build stage.",
+            "# TYPE meshnodes_build_stage_seconds gauge",
+        ]
+        lines += [f'meshnodes_build_stage_seconds{{stage="{k}"}} {v["seconds"]}' for k, v in data["stages"].items()]
+        if self.trace_memory:
+            lines += [
+                "# HELP meshnodes_build_stage_peak_bytes tracemalloc peak during each build stage.",
+                "# TYPE meshnodes_build_stage_peak_bytes gauge",
+            ]
+            lines += [f'meshnodes_build_stage_peak_bytes{{stage="{k}"}} {v["peak_bytes"]}' for k, v in data["stages"].items() if "peak_bytes" in v]
+        lines += [
+            "# HELP meshnodes_build_counter Row and byte counters from the last build.",
+            "# TYPE meshnodes_build_counter gauge",
+        ]
+        lines += [f'meshnodes_build_counter{{name="{k}"}} {v}' for k, v in data["counters"].items()]
+        lines += [
+            "# HELP meshnodes_build_total_seconds Wall time of the whole build.",
+            "# TYPE meshnodes_build_total_seconds gauge",
+            f"meshnodes_build_total_seconds {data['total_seconds']}",
+            "# HELP meshnodes_build_last_run_timestamp_seconds Unix time the last build finished.",
+            "# TYPE meshnodes_build_last_run_timestamp_seconds gauge",
+            f"meshnodes_build_last_run_timestamp_seconds {int(time.time())}",
+            "# HELP meshnodes_build_result 1 for the outcome of the last build.",
+            "# TYPE meshnodes_build_result gauge",
+            f'meshnodes_build_result{{result="{self.result}"}} 1',
+        ]
+        return "\n".join(lines) + "\n"
+
+    def emit(self) -> None:
+        if METRICS_FILE == "-":
+            print(json.dumps(self.as_dict()), file=sys.stderr)
+        elif METRICS_FILE:
+            with atomic_output(METRICS_FILE) as f:
+                json.dump(self.as_dict(), f, indent=2)
+        if METRICS_PROM_FILE:
+            # node-exporter may read at any moment; never let it see a half-written file.
+            with atomic_output(METRICS_PROM_FILE) as f:
+                f.write(self.as_prometheus())
+
+def output_bytes(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+class BuildState:
+    """What --watch keeps between builds: the last build hash, each sheet's parse result by
+    input digest, and the placemark cache."""
+
+    def __init__(self):
+        self.build_hash = ""
+        self.parsed = {}  # sheet -> (input digest, (store, rejects))
+        self.placemarks = None
+
+def build(metrics: BuildMetrics, state: BuildState = None) -> int:
+    """One full fetch -> parse -> render -> write pass. Returns the process exit status."""
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+    state = state or BuildState()
+
+    # -----------------------
+    # Fetch both sheets concurrently, parsing rows as they stream in
+    # -----------------------
+    parsers = {"prospective": parse_prospective, "installed": parse_installed}
+    sources = {"prospective": PROSPECTIVE_CSV_URL, "installed": INSTALLED_CSV_URL}
+    streams = {}
+    parsed = {}
+    with metrics.stage("fetch_parse"):
+        t0 = time.monotonic()
+        for name, stream, result in fetch_all(sources, parsers):
+            metrics.stages[f"fetch_parse.{name}"] = {"seconds": round(time.monotonic() - t0, 6)}
+            streams[name] = stream
+            if result is not None:
+                parsed[name] = result
+    metrics.count("bytes_in", sum(s.bytes_in for s in streams.values()))
+
+    # -----------------------
+    # Skip the build when nothing that shapes the output has changed
+    # -----------------------
+    with metrics.stage("fingerprint"):
+        config_hash = config_fingerprint()
+        build_hash = inputs_fingerprint({n: s.input_digest for n, s in streams.items()}, config_hash)
+    if build_hash == state.build_hash:
+        return EXIT_UNCHANGED
+    if BUILD_MANIFEST:
+        if load_manifest().get("build_hash") == build_hash:
+            print(f"Inputs unchanged (build {build_hash[:12]}); nothing to emit.", file=sys.stderr)
+            return EXIT_UNCHANGED
+    elif all(s.unchanged for s in streams.values()) and all(
+        os.path.exists(os.path.join(output_dir(), p)) for p in (OUTPUT_KML, OUTPUT_NETWORKLINK)
+    ):
+        print(f"Sheets unchanged since last fetch; leaving {OUTPUT_KML} as-is.", file=sys.stderr)
+        return EXIT_UNCHANGED
+    with metrics.stage("parse_cached"):
+        for name, stream in streams.items():
+            if name not in parsed:
+                digest, result = state.parsed.get(name, ("", None))
+                parsed[name] = result if digest == stream.input_digest else parsers[name](stream)
+
+    prospective_store, prospective_rejects = parsed["prospective"]
+    installed_store, installed_rejects = parsed["installed"]
+    metrics.count("rows_prospective", len(prospective_store))
+    metrics.count("rows_installed", len(installed_store))
+    for sheet, (store, rejects) in parsed.items():
+        metrics.count(f"skipped_{sheet}", len(rejects))
+        for (code, column), n in reject_counts(rejects).items():
+            metrics.count(f"skipped_{sheet}_{code}_{column.lower().replace(' ', '_')}", n)
+        metrics.count(f"swapped_{sheet}", store.swapped)
+
+    # -----------------------
+    # Find duplicate sites (optional)
+    # -----------------------
+    if DEDUP_RADIUS_METERS:
+        with metrics.stage("dedup"):
+            stores = {"installed": installed_store, "prospective": prospective_store}
+            duplicates = find_duplicates(stores, DEDUP_RADIUS_METERS, DEDUP_NAME_SIMILARITY)
+            metrics.count("duplicates", len(duplicates))
+            metrics.count("duplicates_folded", apply_duplicates(stores, duplicates, DEDUP_ACTION))
+
+    # -----------------------
+    # Cluster dense areas (optional)
+    # -----------------------
+    p_clustering = i_clustering = None
+    if CLUSTER_LEVELS:
+        with metrics.stage("cluster"):
+            p_clusters, p_pins = cluster_records(prospective_store, CLUSTER_LEVELS, CLUSTER_MIN_POINTS)
+            i_clusters, i_pins = cluster_records(installed_store, CLUSTER_LEVELS, CLUSTER_MIN_POINTS)
+        p_clustering = (p_clusters, p_pins, "p-cluster-", PROSPECTIVE_CATEGORY_ORDER)
+        i_clustering = (i_clusters, i_pins, "i-cluster-", list(INSTALLED_STATUS_COLORS))
+
+    # -----------------------
+    # Emit sites.kml
+    # -----------------------
+    # Prospective: subfolders by category, stable order you defined, then any extras.
+    # Installed: folders by Node Class (stable preferred order), within each A-Z by Node Name.
+    with metrics.stage("sort"):
+        prospective_folders = prospective_store.folders()
+        installed_folders = installed_store.folders()
+        if OUTPUT_UPDATE:
+            prospective_store.assign_ids()
+            installed_store.assign_ids()
+    sections = [
+        ("Prospective Nodes", prospective_folders, prospective_store, PROSPECTIVE_CATEGORY_ORDER, p_clustering),
+        ("Installed Nodes", installed_folders, installed_store, NODE_CLASS_ORDER, i_clustering),
+    ]
+    skipped = {"prospective": prospective_rejects, "installed": installed_rejects}
+
+    # -----------------------
+    # Build styles (only the referenced ones)
+    # -----------------------
+    styles = StyleRegistry(sections)
+    style_defs = styles.defs()
+    style_blocks = styles.blocks()
+
+    # -----------------------
+    # Link budget between installed nodes (optional)
+    # -----------------------
+    links = None
+    link_style_blocks = []
+    if LINK_MAX_KM:
+        with metrics.stage("links"):
+            links = (installed_store, find_links(installed_store, LINK_MAX_KM))
+            link_style_blocks = build_link_style_blocks(links[1])
+        style_blocks += link_style_blocks
+        metrics.count("links", len(links[1]))
+    target_dir = new_version_dir(now, build_hash) if OUTPUT_VERSIONS_DIR else ""
+    out = functools.partial(os.path.join, target_dir)
+    cache = state.placemarks
+    if cache is not None and cache.config_hash == config_hash:
+        cache.start_build()
+    elif PLACEMARK_CACHE:
+        with metrics.stage("load_placemark_cache"):
+            cache = state.placemarks = PlacemarkCache(PLACEMARK_CACHE, config_hash)
+    metrics.count("styles", len(style_defs))
+    with metrics.stage("write_kml"):
+        if OUTPUT_STYLES:
+            with atomic_output(out(OUTPUT_STYLES)) as f:
+                write_styles_kml(f, style_blocks)
+        with atomic_output(out(OUTPUT_KML), buffering=1 << 16) as f:
+            if OUTPUT_STYLES:
+                write_sites_kml(f, now, [], sections, skipped, cache, style_prefix=OUTPUT_STYLES, links=links)
+            else:
+                write_sites_kml(f, now, style_blocks, sections, skipped, cache, links=links)
+
+    if DEDUP_RADIUS_METERS and OUTPUT_DUPLICATES_CSV:
+        write_duplicates(stores, duplicates, out(OUTPUT_DUPLICATES_CSV))
+
+    # -----------------------
+    # Emit sites.geojson (optional)
+    # -----------------------
+    if OUTPUT_GEOJSON:
+        with metrics.stage("write_geojson"):
+            with atomic_output(out(OUTPUT_GEOJSON), buffering=1 << 16) as f:
+                write_geojson(f, now, sections, style_defs)
+
+    # -----------------------
+    # Emit rejects.csv / rejects.json
+    # -----------------------
+    if OUTPUT_REJECTS_CSV or OUTPUT_REJECTS_JSON:
+        with metrics.stage("write_rejects"):
+            write_rejects(skipped, OUTPUT_REJECTS_CSV and out(OUTPUT_REJECTS_CSV), OUTPUT_REJECTS_JSON and out(OUTPUT_REJECTS_JSON))
+
+    # -----------------------
+    # Emit sites.kmz (optional)
+    # -----------------------
+    if OUTPUT_KMZ:
+        with metrics.stage("write_kmz"):
+            icon_hrefs, icon_files = bundle_icons(icon_url for _, _, icon_url in style_defs)
+            kmz_style_blocks = styles.blocks(icon_hrefs) + link_style_blocks
+            write_kmz(out(OUTPUT_KMZ), lambda f: write_sites_kml(f, now, kmz_style_blocks, sections, skipped, cache, links=links), icon_files)
+
+    # -----------------------
+    # Emit tiles (optional)
+    # -----------------------
+    if TILES_DIR:
+        with metrics.stage("write_tiles"):
+            write_tiles(out(TILES_DIR), now, style_blocks, sections, skipped)
+
+    # -----------------------
+    # Emit update.kml + networklink-live.kml (optional)
+    # -----------------------
+    if OUTPUT_UPDATE:
+        with metrics.stage("write_update"):
+            sites_href = DATASET_URL or SITE_BASE_URL + OUTPUT_KML
+            footer = description_footer()
+            style_ids = [sid for sid, _, _ in style_defs]
+            snapshot = placemark_snapshot(sections, footer, style_ids)
+            inline_styles = None if OUTPUT_STYLES else dict(zip(style_ids, styles.blocks()))
+            with atomic_output(out(OUTPUT_UPDATE), buffering=1 << 16) as f:
+                ops = write_update_kml(f, sites_href, sections, footer, load_snapshot(config_hash), snapshot, OUTPUT_STYLES, inline_styles)
+            if OUTPUT_LIVE_NETWORKLINK:
+                replace_if_changed(out(OUTPUT_LIVE_NETWORKLINK), live_networklink_kml(sites_href, SITE_BASE_URL + OUTPUT_UPDATE))
+            write_snapshot(snapshot, config_hash)
+        for op, n in ops.items():
+            metrics.count(f"update_{op}", n)
 
     # -----------------------
     # Emit networklink.kml
     # -----------------------
-    href = DATASET_URL or "https://txkbaldlaw.github.io/meshnodes-site-map/sites.kml"
+    href = DATASET_URL or SITE_BASE_URL + (OUTPUT_KMZ if OUTPUT_KMZ and NETWORKLINK_USE_KMZ else OUTPUT_KML)
     networklink_kml = f"""<?xml version="1.0" encoding="UTF-8"?>
 <kml xmlns="http://www.opengis.net/kml/2.2">
   <NetworkLink>
@@ -426,8 +2424,317 @@ def main() -> None:
   </NetworkLink>
 </kml>
 """
-    with open(OUTPUT_NETWORKLINK, "w", encoding="utf-8") as f:
-        f.write(networklink_kml)
+    replace_if_changed(out(OUTPUT_NETWORKLINK), networklink_kml)
+
+    if cache is not None:
+        with metrics.stage("save_placemark_cache"):
+            cache.save()
+        metrics.count("placemark_cache_hits", cache.hits)
+        metrics.count("placemark_cache_misses", cache.misses)
+
+    if target_dir:
+        write_manifest(build_hash, now, out("manifest.json"))
+        publish_version(target_dir)
+    write_manifest(build_hash, now)
+    state.build_hash = build_hash
+    state.parsed = {name: (streams[name].input_digest, result) for name, result in parsed.items()}
+    metrics.count("bytes_out", sum(output_bytes(os.path.join(output_dir(), p)) for p in build_outputs()))
+    return 0
+
+def run_once(state: BuildState = None) -> int:
+    metrics = BuildMetrics()
+    status = 1
+    try:
+        status = build(metrics, state)
+    finally:
+        metrics.result = {0: "built", EXIT_UNCHANGED: "unchanged"}.get(status, "failed")
+        metrics.emit()
+    return status
+
+def watch(interval: float, on_build=None) -> None:
+    """Rebuild whenever the sheets change, until interrupted. `on_build(status)` runs after each poll."""
+    state = BuildState()
+    failures = 0
+    while True:
+        try:
+            status = run_once(state)
+        except (Exception, SystemExit) as e:  # die() raises SystemExit; keep polling
+            if not isinstance(e, SystemExit):
+                print(f"ERROR: build failed: {e!r}", file=sys.stderr)
+            status = 1
+        if status == 0:
+            print(f"Rebuilt {OUTPUT_KML} ({datetime.now(timezone.utc):%Y-%m-%d %H:%M:%SZ}).", file=sys.stderr)
+        if on_build:
+            on_build(status)
+        failures = 0 if status in (0, EXIT_UNCHANGED) else failures + 1
+        delay = min(WATCH_MAX_BACKOFF_SECONDS, interval * 2 ** failures)
+        time.sleep(delay * random.uniform(1 - WATCH_JITTER, 1 + WATCH_JITTER))
+
+# -----------------------
+# Multi-dataset federation
+# -----------------------
+def load_datasets(path: str) -> list:
+    try:
+        with open(path, encoding="utf-8") as f:
+            datasets = json.load(f)
+    except (OSError, ValueError) as e:
+        die(f"Cannot read DATASETS_FILE {path}: {e}")
+    if not isinstance(datasets, list) or not datasets:
+        die(f"DATASETS_FILE {path} must hold a non-empty JSON list")
+    prefixes = set()
+    for d in datasets:
+        missing = [k for k in ("name", "prospective_url", "installed_url", "output_prefix") if not str(d.get(k, "")).strip()]
+        if missing:
+            die(f"Dataset {d.get('name', '?')!r} is missing {missing}")
+        prefix = os.path.normpath(d["output_prefix"])
+        if os.path.isabs(prefix) or prefix.startswith("..") or prefix in prefixes:
+            die(f"Dataset {d['name']!r}: output_prefix must be a unique relative directory")
+        prefixes.add(prefix)
+    return datasets
+
+def build_dataset(dataset: dict) -> tuple:
+    """Build one dataset in a child process. Returns (name, exit status, captured stderr)."""
+    prefix = os.path.normpath(dataset["output_prefix"])
+    os.makedirs(prefix, exist_ok=True)
+    env = dict(
+        os.environ,
+        DATASETS_FILE="",
+        DATASET_NAME=dataset["name"],
+        PROSPECTIVE_CSV_URL=dataset["prospective_url"],
+        INSTALLED_CSV_URL=dataset["installed_url"],
+        DATASET_URL=dataset.get("dataset_url", ""),
+        SITE_BASE_URL=f"{SITE_BASE_URL}{prefix.replace(os.sep, '/')}/",
+    )
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__)], cwd=prefix, env=env, capture_output=True, text=True,
+    )
+    return dataset["name"], proc.returncode, proc.stderr
+
+def master_networklink_kml(datasets: list) -> str:
+    links = "".join(f"""
+    <NetworkLink>
+      <name>{html.escape(d["name"])}</name>
+      <Link>
+        <href>{html.escape(d.get("dataset_url") or f"{SITE_BASE_URL}{os.path.normpath(d['output_prefix']).replace(os.sep, '/')}/{OUTPUT_KML}")}</href>
+        <refreshMode>onInterval</refreshMode>
+        <refreshInterval>{REFRESH_SECONDS}</refreshInterval>
+      </Link>
+    </NetworkLink>""" for d in datasets)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>{html.escape(NETWORKLINK_NAME)}</name>
+    <open>1</open>{links}
+  </Document>
+</kml>
+"""
+
+def build_federation(datasets: list) -> int:
+    """Build every dataset in parallel, then write the master NetworkLink. Exits EXIT_UNCHANGED
+    only when every dataset and the master file were unchanged, 1 if any dataset failed."""
+    statuses = []
+    with ThreadPoolExecutor(max_workers=min(DATASETS_MAX_WORKERS, len(datasets))) as pool:
+        for name, status, log in pool.map(build_dataset, datasets):
+            for line in log.splitlines():
+                print(f"[{name}] {line}", file=sys.stderr)
+            if status not in (0, EXIT_UNCHANGED):
+                print(f"ERROR: dataset {name!r} failed (exit {status})", file=sys.stderr)
+            statuses.append(status)
+    master_changed = replace_if_changed(OUTPUT_NETWORKLINK, master_networklink_kml(datasets))
+    if any(s not in (0, EXIT_UNCHANGED) for s in statuses):
+        return 1
+    return EXIT_UNCHANGED if not master_changed and all(s == EXIT_UNCHANGED for s in statuses) else 0
+
+# -----------------------
+# Built-in HTTP server
+# -----------------------
+CONTENT_TYPES = {
+    ".kml": "application/vnd.google-earth.kml+xml",
+    ".kmz": "application/vnd.google-earth.kmz",
+    ".json": "application/json",
+    ".geojson": "application/geo+json",
+    ".csv": "text/csv; charset=utf-8",
+    ".png": "image/png",
+}
+COMPRESSIBLE = (".kml", ".json", ".geojson", ".csv")
+
+class Asset:
+    """One servable file: its bytes, precompressed variants and their strong ETags."""
+
+    def __init__(self, path: str, body: bytes):
+        self.content_type = CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+        tag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {"identity": (body, f'"{tag}"')}
+        if path.lower().endswith(COMPRESSIBLE):
+            self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{tag}-gz"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body), f'"{tag}-br"')
+
+def load_site() -> dict:
+    """URL path -> Asset for everything the last build wrote, plus the bundled icons."""
+    files = {}
+    root = os.path.realpath(output_dir() or ".")  # resolve `current` once; a flip mid-load can't mix builds
+    for out in build_outputs():
+        out = os.path.join(root, out)
+        if os.path.isdir(out):
+            for e in os.scandir(out):
+                if e.is_file() and not e.name.endswith(".tmp"):
+                    files[f"/{os.path.basename(os.path.normpath(out))}/{e.name}"] = e.path
+        elif os.path.exists(out):
+            files[f"/{os.path.basename(out)}"] = out
+    if os.path.isdir(LOCAL_ICON_DIR):
+        for e in os.scandir(LOCAL_ICON_DIR):
+            if e.is_file():
+                files[f"/img/{e.name}"] = e.path
+    site = {}
+    for url_path, path in files.items():
+        with open(path, "rb") as f:
+            site[url_path] = Asset(path, f.read())
+    return site
+
+def accepted_encodings(header: str) -> set:
+    """Codings listed in Accept-Encoding, minus any explicitly refused with q=0."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        q = params.strip().lower()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+def parse_range(header: str, size: int):
+    """(start, end) inclusive for a single "bytes=" range, None to ignore it, or "" if unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # multiple ranges: just send the whole thing
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            n = int(last)
+            return (max(0, size - n), size - 1) if n > 0 and size else ""
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    return (start, end) if start <= end and start < size else ""
+
+class SiteHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "meshnodes-site-map"
+    protocol_version = "HTTP/1.1"
+    site = {}  # replaced wholesale after every build
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False):
+        path = self.path.split("?", 1)[0]
+        asset = self.site.get("/" + OUTPUT_KML if path == "/" else path)
+        if asset is None:
+            self.send_error(404)
+            return
+        ranged = self.headers.get("Range")
+        if ranged and self.headers.get("If-Range") not in (None, asset.variants["identity"][1]):
+            ranged = None
+        encoding = "identity"
+        if not ranged:  # ranges are always over the identity bytes
+            accepted = accepted_encodings(self.headers.get("Accept-Encoding", ""))
+            encoding = next((e for e in ("br", "gzip") if e in asset.variants and e in accepted), "identity")
+        body, etag = asset.variants[encoding]
+
+        status = 200
+        headers = {"ETag": etag, "Cache-Control": SERVE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        inm = self.headers.get("If-None-Match")
+        if inm and (inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]):
+            self.send_response(304)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if ranged:
+            span = parse_range(ranged, len(body))
+            if span == "":
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if span:
+                start, end = span
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+                body = body[start:end + 1]
+                status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", asset.content_type)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+def serve(address: str, interval: float) -> None:
+    """Serve the build over HTTP while the watch loop keeps it fresh."""
+    host, _, port = address.rpartition(":")
+    server = http.server.ThreadingHTTPServer((host or "0.0.0.0", int(port)), SiteHandler)
+    server.daemon_threads = True
+    SiteHandler.site = load_site()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving on http://{host or '0.0.0.0'}:{server.server_address[1]}/", file=sys.stderr)
+
+    def reload(status: int) -> None:
+        if status == 0 or not SiteHandler.site:
+            SiteHandler.site = load_site()
+
+    try:
+        watch(interval, reload)
+    finally:
+        server.shutdown()
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Build sites.kml and networklink.kml from the Prospective/Installed sheets.")
+    ap.add_argument("--watch", action="store_true", help="keep running and rebuild whenever the sheets change")
+    ap.add_argument("--interval", type=float, default=WATCH_INTERVAL_SECONDS,
+                    help=f"seconds between polls in --watch mode (default {WATCH_INTERVAL_SECONDS:g})")
+    ap.add_argument("--serve", metavar="[HOST:]PORT", help="like --watch, and also serve the outputs over HTTP")
+    args = ap.parse_args()
+
+    if DATASETS_FILE:
+        if args.watch or args.serve:
+            die("--watch/--serve build a single dataset; run one per region instead of DATASETS_FILE")
+        sys.exit(build_federation(load_datasets(DATASETS_FILE)))
+
+    if not PROSPECTIVE_CSV_URL:
+        die("PROSPECTIVE_CSV_URL env var is required")
+    if not INSTALLED_CSV_URL:
+        die("INSTALLED_CSV_URL env var is required")
+    if COORD_BBOX and len(COORD_BBOX) != 4:
+        die(f"COORD_BBOX must be west,south,east,north; got {COORD_BBOX}")
+    if DEDUP_ACTION not in ("annotate", "fold"):
+        die(f"DEDUP_ACTION must be annotate or fold; got {DEDUP_ACTION!r}")
+    if os.path.isabs(OUTPUT_STYLES):
+        die("OUTPUT_STYLES is referenced from sites.kml, so it must be a relative path")
+    if OUTPUT_VERSIONS_DIR and any(os.path.isabs(p) for p in build_outputs()):
+        die("OUTPUT_VERSIONS_DIR needs relative output paths")
+
+    if args.watch or args.serve:
+        try:
+            if args.serve:
+                serve(args.serve, args.interval)
+            else:
+                watch(args.interval)
+        except KeyboardInterrupt:
+            pass
+        return
+    sys.exit(run_once())
 
 if __name__ == "__main__":
     main()